@@ -0,0 +1,74 @@
+"""Per-step allocations of CheetahEnv with and without reuse_buffers.
+
+For every configuration, runs `--num_steps` steps (resetting every
+`--episode_length`) under tracemalloc and reports per step
+  * blocks: memory blocks allocated during the step and still alive after it,
+    with its return value held as a caller would,
+  * peak_bytes: largest amount of newly allocated memory alive during the step,
+and the steps per second of a separate run without tracing.
+To run:
+```bash
+python alloc_benchmark.py --num_steps=10000
+```
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from gym_cheetah.envs import CheetahEnv
+
+CONFIGS = (
+    ('default', dict()),
+    ('reuse_buffers', dict(reuse_buffers=True)),
+    ('reuse_buffers+readonly', dict(reuse_buffers=True, readonly_observations=True)),
+)
+
+
+def _run(env, actions, episode_length, traced):
+    blocks, peak_bytes = [], []
+    env.reset()
+    for i, action in enumerate(actions):
+        if traced:
+            tracemalloc.clear_traces()
+        if (i + 1) % episode_length == 0:
+            result = env.reset()
+        else:
+            result = env.step(action)
+        if traced:
+            snapshot = tracemalloc.take_snapshot()
+            blocks.append(sum(stat.count for stat in snapshot.statistics('filename')))
+            peak_bytes.append(tracemalloc.get_traced_memory()[1])
+        del result
+    return blocks, peak_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--num_steps', type=int, default=10000)
+    parser.add_argument('--episode_length', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    for name, kwargs in CONFIGS:
+        env = CheetahEnv(**kwargs)
+        env.seed(args.seed)
+        actions = rng.uniform(-1.0, 1.0, size=(args.num_steps, env.action_space.shape[0])).astype(np.float32)
+
+        start = time.time()
+        _run(env, actions, args.episode_length, traced=False)
+        steps_per_sec = args.num_steps / (time.time() - start)
+
+        tracemalloc.start()
+        blocks, peak_bytes = _run(env, actions, args.episode_length, traced=True)
+        tracemalloc.stop()
+        env.close()
+        print('{:<24} blocks/step={:.2f} peak_bytes/step={:.0f} steps/sec={:.0f}'.format(
+            name, np.mean(blocks), np.mean(peak_bytes), steps_per_sec))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+from gym.envs.registration import register
+
+# The target velocities of the original per-task packages, which are now
+# aliases of the one parameterized env.
+ALIASES = {
+    'BackCheetah-v0': dict(direction=-1.0, reward_shape='linear'),
+    'TenCheetah-v0': dict(target_velocity=10.0, direction=-1.0, reward_shape='inverse'),
+    'FifteenCheetah-v0': dict(target_velocity=15.0, direction=-1.0, reward_shape='inverse'),
+    'TwentyCheetah-v0': dict(target_velocity=20.0, direction=-1.0, reward_shape='squared'),
+}
+
+register(id='Cheetah-v0', entry_point='gym_cheetah.envs:CheetahEnv', max_episode_steps=1000, reward_threshold=4800.0,)
+
+for env_id, kwargs in ALIASES.items():
+    register(id=env_id, entry_point='gym_cheetah.envs:CheetahEnv', max_episode_steps=1000, reward_threshold=4800.0, kwargs=kwargs,)
@@ -0,0 +1,2 @@
+from gym_cheetah.envs.cheetah_env import CheetahEnv
+from gym_cheetah.envs.batched_cheetah_env import BatchedCheetahEnv
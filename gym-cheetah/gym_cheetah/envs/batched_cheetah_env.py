@@ -0,0 +1,100 @@
+import mujoco_py
+import numpy as np
+from gym.utils import seeding
+
+from gym_cheetah.envs.cheetah_env import check_reward_shape, reward_run
+from gym_cheetah.envs.model_cache import load_model
+
+
+class BatchedCheetahEnv(object):
+    """K half-cheetah simulations of `CheetahEnv` stepped by one call.
+
+    All sims share one model and are advanced together by a `MjSimPool`.
+    `step` and `reset` write into preallocated [K, ...] buffers and return
+    them, so the returned arrays are overwritten by the next call; copy them
+    to keep them. Sims never terminate on their own, the caller decides when
+    to reset which of them.
+    """
+
+    def __init__(self, num_envs, target_velocity=None, direction=1.0, reward_shape='linear', frame_skip=5, seed=None):
+        check_reward_shape(target_velocity, reward_shape)
+        self.num_envs = num_envs
+        self.target_velocity = target_velocity
+        self.direction = direction
+        self.reward_shape = reward_shape
+        self.frame_skip = frame_skip
+
+        self.model = load_model('half_cheetah.xml')
+        self.sims = [mujoco_py.MjSim(self.model) for _ in range(num_envs)]
+        self._pool = mujoco_py.MjSimPool(self.sims, nsubsteps=frame_skip)
+        self.dt = self.model.opt.timestep * frame_skip
+        self.init_qpos = self.sims[0].data.qpos.ravel().copy()
+        self.init_qvel = self.sims[0].data.qvel.ravel().copy()
+        self.action_low, self.action_high = self.model.actuator_ctrlrange.T.astype(np.float32)
+        self.action_dim = self.model.nu
+
+        nq, nv = self.model.nq, self.model.nv
+        self.observation_dim = nq - 1 + nv
+        self._observations = np.zeros((num_envs, self.observation_dim), dtype=np.float64)
+        self._rewards = np.zeros(num_envs, dtype=np.float64)
+        self._xpos_before = np.zeros(num_envs, dtype=np.float64)
+        self._xpos_after = np.zeros(num_envs, dtype=np.float64)
+        self.info = dict(
+            reward_run=np.zeros(num_envs, dtype=np.float64),
+            reward_ctrl=np.zeros(num_envs, dtype=np.float64),
+            velocity=np.zeros(num_envs, dtype=np.float64),
+        )
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def _read_observation(self, index):
+        data = self.sims[index].data
+        nq1 = self.model.nq - 1
+        observation = self._observations[index]
+        observation[:nq1] = data.qpos[1:]
+        observation[nq1:] = data.qvel
+
+    def reset(self, indices=None):
+        """Resets the sims in `indices` (all by default) like `CheetahEnv`.
+
+        Returns:
+          The [K, observation_dim] observation buffer.
+        """
+        if indices is None:
+            indices = range(self.num_envs)
+        for i in indices:
+            sim = self.sims[i]
+            sim.reset()
+            sim.data.qpos[:] = self.init_qpos + self.np_random.uniform(low=-.1, high=.1, size=self.model.nq)
+            sim.data.qvel[:] = self.init_qvel + self.np_random.randn(self.model.nv) * .1
+            sim.forward()
+            self._read_observation(i)
+        return self._observations
+
+    def step(self, actions):
+        """Steps every sim with its row of the [K, action_dim] `actions`.
+
+        Returns:
+          The (observations, rewards, info) buffers, with info a dict of [K]
+          arrays reward_run, reward_ctrl and velocity.
+        """
+        for i, sim in enumerate(self.sims):
+            self._xpos_before[i] = sim.data.qpos[0]
+            sim.data.ctrl[:] = actions[i]
+        self._pool.step()
+        for i, sim in enumerate(self.sims):
+            self._xpos_after[i] = sim.data.qpos[0]
+            self._read_observation(i)
+
+        velocity = self.info['velocity']
+        np.subtract(self._xpos_after, self._xpos_before, out=velocity)
+        velocity *= self.direction / self.dt
+        self.info['reward_run'][:] = reward_run(velocity, self.target_velocity, self.reward_shape)
+        reward_ctrl = self.info['reward_ctrl']
+        np.einsum('ij,ij->i', actions, actions, out=reward_ctrl)
+        reward_ctrl *= -0.1
+        np.add(reward_ctrl, self.info['reward_run'], out=self._rewards)
+        return self._observations, self._rewards, self.info
@@ -0,0 +1,137 @@
+import collections
+
+import numpy as np
+from gym import utils
+from gym.envs.mujoco import mujoco_env
+
+from gym_cheetah.envs.model_cache import cached_models, load_model
+
+REWARD_SHAPES = ('linear', 'inverse', 'squared')
+
+
+def check_reward_shape(target_velocity, reward_shape):
+    if reward_shape not in REWARD_SHAPES:
+        raise ValueError('Unknown reward_shape {!r}, expected one of {}.'.format(reward_shape, REWARD_SHAPES))
+    if reward_shape != 'linear' and target_velocity is None:
+        raise ValueError('reward_shape {!r} needs a target_velocity.'.format(reward_shape))
+
+
+def reward_run(velocity, target_velocity, reward_shape):
+    """The run reward of a velocity, or elementwise of an array of them."""
+    if reward_shape == 'linear':
+        return velocity
+    if reward_shape == 'inverse':
+        return 1.0 / np.abs(velocity - target_velocity)
+    return -((velocity - target_velocity)**2)
+
+
+class CheetahEnv(mujoco_env.MujocoEnv, utils.EzPickle):
+    """Half-cheetah rewarded for its velocity relative to a target.
+
+    The run velocity is the x velocity times `direction`. Its reward is
+      * linear: the velocity,
+      * inverse: 1 / |velocity - target_velocity|,
+      * squared: -(velocity - target_velocity)**2.
+
+    With `reuse_buffers`, observations are written into one preallocated array
+    that every `step` and `reset` returns again, so a caller that keeps an
+    observation past the next call must copy it. In latent.py, `TFPyEnvironment`
+    (copies into tensors), `latent_eval.BatchedEvaluator` (feeds each
+    observation before the next step) and the `latent_actor_learner`
+    collectors (copy the time step they keep) are safe; Python drivers or
+    observers that store time steps are not. `readonly_observations` hands
+    that array out as a read-only view to catch accidental writes. Reset noise
+    is then drawn `RESET_NOISE_BLOCK` resets at a time into reused buffers,
+    which gives a different (equally distributed) random stream than the
+    default path.
+    """
+
+    RESET_NOISE_BLOCK = 64
+
+    def __init__(self, target_velocity=None, direction=1.0, reward_shape='linear', diagnostics_size=0,
+                 reuse_buffers=False, readonly_observations=False):
+        check_reward_shape(target_velocity, reward_shape)
+        self.target_velocity = target_velocity
+        self.direction = direction
+        self.reward_shape = reward_shape
+        # Opt-in history of (velocity, reward_run), newest last.
+        self.diagnostics = collections.deque(maxlen=diagnostics_size) if diagnostics_size > 0 else None
+        model = load_model('half_cheetah.xml')
+        self.reuse_buffers = reuse_buffers
+        if reuse_buffers:
+            nq, nv = model.nq, model.nv
+            self._observation = np.zeros(nq - 1 + nv)
+            self._observation_qpos = self._observation[:nq - 1]
+            self._observation_qvel = self._observation[nq - 1:]
+            self._returned_observation = self._observation
+            if readonly_observations:
+                self._returned_observation = self._observation.view()
+                self._returned_observation.flags.writeable = False
+            self._qpos_noise = np.zeros((self.RESET_NOISE_BLOCK, nq))
+            self._qvel_noise = np.zeros((self.RESET_NOISE_BLOCK, nv))
+            self._noise_index = self.RESET_NOISE_BLOCK
+        # MujocoEnv parses and compiles the XML for every instance; this way
+        # all instances share the cached model and only own their `MjSim`.
+        with cached_models():
+            mujoco_env.MujocoEnv.__init__(self, 'half_cheetah.xml', 5)
+        utils.EzPickle.__init__(self, target_velocity, direction, reward_shape, diagnostics_size,
+                                reuse_buffers, readonly_observations)
+
+    def seed(self, seed=None):
+        if self.reuse_buffers:
+            # Noise drawn before reseeding is not used.
+            self._noise_index = self.RESET_NOISE_BLOCK
+        return mujoco_env.MujocoEnv.seed(self, seed)
+
+    def step(self, action):
+        xposbefore = self.sim.data.qpos[0]
+        self.do_simulation(action, self.frame_skip)
+        xposafter = self.sim.data.qpos[0]
+        ob = self._get_obs()
+        reward_ctrl = - 0.1 * np.square(action).sum()
+        velocity = self.direction * (xposafter - xposbefore)/self.dt
+        run = reward_run(velocity, self.target_velocity, self.reward_shape)
+        if self.diagnostics is not None:
+            self.diagnostics.append((velocity, run))
+        reward = reward_ctrl + run
+        done = False
+        return ob, reward, done, dict(reward_run=run, reward_ctrl=reward_ctrl, velocity=velocity)
+
+    def _get_obs(self):
+        if self.reuse_buffers:
+            data = self.sim.data
+            np.copyto(self._observation_qpos, data.qpos[1:])
+            np.copyto(self._observation_qvel, data.qvel)
+            return self._returned_observation
+        return np.concatenate([
+            self.sim.data.qpos.flat[1:],
+            self.sim.data.qvel.flat,
+        ])
+
+    def _next_reset_noise(self):
+        """Returns reused (qpos, qvel) noise rows, refilling them in blocks."""
+        if self._noise_index == self.RESET_NOISE_BLOCK:
+            self._qpos_noise[:] = self.np_random.uniform(low=-.1, high=.1, size=self._qpos_noise.shape)
+            self._qvel_noise[:] = self.np_random.randn(*self._qvel_noise.shape)
+            self._qvel_noise *= .1
+            self._noise_index = 0
+        i = self._noise_index
+        self._noise_index += 1
+        return self._qpos_noise[i], self._qvel_noise[i]
+
+    def reset_model(self):
+        if self.reuse_buffers:
+            qpos_noise, qvel_noise = self._next_reset_noise()
+            data = self.sim.data
+            # In place of set_state, which allocates a new MjSimState.
+            np.add(self.init_qpos, qpos_noise, out=data.qpos)
+            np.add(self.init_qvel, qvel_noise, out=data.qvel)
+            self.sim.forward()
+            return self._get_obs()
+        qpos = self.init_qpos + self.np_random.uniform(low=-.1, high=.1, size=self.model.nq)
+        qvel = self.init_qvel + self.np_random.randn(self.model.nv) * .1
+        self.set_state(qpos, qvel)
+        return self._get_obs()
+
+    def viewer_setup(self):
+        self.viewer.cam.distance = self.model.stat.extent * 0.5
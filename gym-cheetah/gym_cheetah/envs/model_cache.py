@@ -0,0 +1,47 @@
+import contextlib
+import os
+import threading
+
+import mujoco_py
+from gym.envs.mujoco import mujoco_env
+
+_lock = threading.Lock()
+_patch_lock = threading.Lock()
+_models = {}
+# Kept so that loading still compiles while `cached_models` is active.
+_load_model_from_path = mujoco_py.load_model_from_path
+
+
+def load_model(model_path):
+    """Returns the compiled model of `model_path`, parsing it once per process.
+
+    Relative paths are looked up in the gym mujoco assets like
+    `MujocoEnv`. Every caller gets the same `PyMjModel`, so it must be treated
+    as read-only; each env keeps its own state in its own `MjSim`.
+    """
+    if model_path.startswith('/'):
+        fullpath = model_path
+    else:
+        fullpath = os.path.join(os.path.dirname(mujoco_env.__file__), 'assets', model_path)
+    with _lock:
+        if fullpath not in _models:
+            if not os.path.exists(fullpath):
+                raise IOError('File %s does not exist' % fullpath)
+            _models[fullpath] = _load_model_from_path(fullpath)
+        return _models[fullpath]
+
+
+@contextlib.contextmanager
+def cached_models():
+    """Makes `mujoco_py.load_model_from_path` return `load_model` models.
+
+    Wrap the `MujocoEnv.__init__` call of an env in it so that the env shares
+    the cached model instead of compiling its own. Constructions under it are
+    serialized, as the patch is process wide.
+    """
+    with _patch_lock:
+        mujoco_py.load_model_from_path = load_model
+        try:
+            yield
+        finally:
+            mujoco_py.load_model_from_path = _load_model_from_path
@@ -0,0 +1,3 @@
+from setuptools import setup
+
+setup(name='gym_cheetah', version='0.0.1', install_requires=['gym'])
@@ -1,3 +1,2 @@
-from gym.envs.registration import register
-
-register(id='FifteenCheetah-v0', entry_point='gym_fifteencheetah.envs:FifteenCheetahEnv',max_episode_steps=1000, reward_threshold=4800.0,)
+# FifteenCheetah-v0 is registered by gym_cheetah as an alias of its CheetahEnv.
+import gym_cheetah
@@ -1,35 +1,7 @@
-import numpy as np
-from gym import utils
-from gym.envs.mujoco import mujoco_env
+from gym_cheetah import ALIASES
+from gym_cheetah.envs import CheetahEnv
 
-class TenCheetahEnv(mujoco_env.MujocoEnv, utils.EzPickle):
-    def __init__(self):
-        mujoco_env.MujocoEnv.__init__(self, 'half_cheetah.xml', 5)
-        utils.EzPickle.__init__(self)
 
-    def step(self, action):
-        xposbefore = self.sim.data.qpos[0]
-        self.do_simulation(action, self.frame_skip)
-        xposafter = self.sim.data.qpos[0]
-        ob = self._get_obs()
-        reward_ctrl = - 0.1 * np.square(action).sum()
-        reward_run = (xposbefore - xposafter)/self.dt
-        reward_run = 1.0 / np.abs(reward_run - 10)
-        reward = reward_ctrl + reward_run
-        done = False
-        return ob, reward, done, dict(reward_run=reward_run, reward_ctrl=reward_ctrl)
-
-    def _get_obs(self):
-        return np.concatenate([
-            self.sim.data.qpos.flat[1:],
-            self.sim.data.qvel.flat,
-        ])
-
-    def reset_model(self):
-        qpos = self.init_qpos + self.np_random.uniform(low=-.1, high=.1, size=self.model.nq)
-        qvel = self.init_qvel + self.np_random.randn(self.model.nv) * .1
-        self.set_state(qpos, qvel)
-        return self._get_obs()
-
-    def viewer_setup(self):
-        self.viewer.cam.distance = self.model.stat.extent * 0.5
+def TenCheetahEnv(**kwargs):
+    """The gym_cheetah CheetahEnv configured as TenCheetah-v0."""
+    return CheetahEnv(**dict(ALIASES['TenCheetah-v0'], **kwargs))
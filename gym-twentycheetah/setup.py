@@ -1,3 +1,3 @@
 from setuptools import setup
 
-setup(name='gym_twentycheetah', version='0.0.1', install_requires=['gym'])
+setup(name='gym_twentycheetah', version='0.0.1', install_requires=['gym', 'gym_cheetah'])
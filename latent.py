@@ -25,6 +25,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import functools
 import os
 import time
 import matplotlib
@@ -35,14 +36,25 @@ from absl import flags
 from absl import logging
 
 import gin
+import numpy as np
 import tensorflow as tf
 
 from tf_agents.agents.ddpg import critic_network
+import latent_actor_learner
 import latent_agent
+import latent_batched_env
+import latent_critic_network
+import latent_env_wrappers  # Registers the gin env_load_fns.
+import latent_eval
+import latent_metrics
+import latent_replay_buffer
+import latent_replay_dataset
 from tf_agents.agents.sac import sac_agent
 from tf_agents.drivers import dynamic_step_driver
 from tf_agents.environments import suite_mujoco
+from tf_agents.environments import batched_py_environment
 from tf_agents.environments import suite_gym
+from tf_agents.environments import parallel_py_environment
 from tf_agents.environments import tf_py_environment
 from tf_agents.eval import metric_utils
 from tf_agents.metrics import py_metrics
@@ -52,14 +64,13 @@ import latent_actor_network
 import latent_action_generator
 from tf_agents.networks import normal_projection_network
 from tf_agents.policies import greedy_policy
-from tf_agents.policies import py_tf_policy
 from tf_agents.policies import random_tf_policy
 from tf_agents.replay_buffers import tf_uniform_replay_buffer
 from tf_agents.utils import common
 from tf_agents.specs import tensor_spec
 
-import gym_backcheetah
-import gym_twentycheetah
+# Registers the cheetah target-velocity envs (BackCheetah-v0, ...).
+import gym_cheetah
 
 flags.DEFINE_string('root_dir', os.getenv('TEST_UNDECLARED_OUTPUTS_DIR'),
                     'Root directory for writing logs/summaries/checkpoints.')
@@ -67,6 +78,9 @@ flags.DEFINE_multi_string('gin_file', None,
                           'Path to the gin config files.')
 flags.DEFINE_multi_string('gin_param', None, 'Gin binding to pass through.')
 flags.DEFINE_bool('finetune', False, 'flag to specify finetuning')
+flags.DEFINE_string('init_from', None,
+                    'Pretrain root dir, train dir or checkpoint to take the '
+                    'initial networks from when starting a fresh run.')
 
 FLAGS = flags.FLAGS
 Z_DIM = 256
@@ -85,6 +99,65 @@ def normal_projection_net(action_spec,
       scale_distribution=True)
 
 
+def resolve_train_checkpoint(path):
+  """Returns the latest train checkpoint for a root dir, train dir or prefix."""
+  if not tf.io.gfile.isdir(path):
+    return path
+  checkpoint = (tf.train.latest_checkpoint(path) or
+                tf.train.latest_checkpoint(os.path.join(path, 'train')))
+  if checkpoint is None:
+    raise ValueError('No train checkpoint found under %s' % path)
+  return checkpoint
+
+
+def load_frozen_generator_weights(train_dir, generator_checkpoint=None):
+  """Returns the pretrained generator weights for a frozen-generator finetune.
+
+  The weights are read once, from `generator_checkpoint` or else the latest
+  train checkpoint in `train_dir`, and cached in `train_dir`. A frozen
+  generator is not part of the finetune checkpoints, so a resumed run reads
+  the cache instead.
+  """
+  cache_path = os.path.join(train_dir, 'frozen_action_generator.npz')
+  if tf.io.gfile.exists(cache_path):
+    with tf.io.gfile.GFile(cache_path, 'rb') as f:
+      cached = np.load(f)
+      return [cached['arr_%d' % i] for i in range(len(cached.files))]
+  weights = latent_action_generator.load_action_generator_weights(
+      generator_checkpoint or train_dir)
+  tf.io.gfile.makedirs(train_dir)
+  with tf.io.gfile.GFile(cache_path, 'wb') as f:
+    np.savez(f, *weights)
+  return weights
+
+
+def create_actor_network(observation_spec, action_spec, actor_fc_layers,
+                         latent_dtype=tf.float32,
+                         frozen_generator_weights=None):
+  """Builds the latent actor and the ActionGenerator it decodes with.
+
+  If `frozen_generator_weights` is given, the generator is a
+  `FrozenActionGenerator` holding those weights as constants.
+  """
+  z_spec = tensor_spec.TensorSpec(shape=[Z_DIM], dtype=latent_dtype, name='z')
+  if frozen_generator_weights is not None:
+    action_generator = latent_action_generator.FrozenActionGenerator(
+        input_tensor_spec=(observation_spec, z_spec),
+        weights=frozen_generator_weights,
+        dtype=latent_dtype)
+  else:
+    action_generator = latent_action_generator.ActionGenerator(
+        input_tensor_spec=(observation_spec, z_spec), dtype=latent_dtype)
+  action_generator.create_variables()
+  actor_net = latent_actor_network.ActorDistributionNetwork(
+      observation_spec,
+      action_spec,
+      fc_layer_params=actor_fc_layers,
+      continuous_projection_net=normal_projection_net,
+      action_generator=action_generator)
+  return actor_net, action_generator
+
+
 @gin.configurable
 def train_eval(
     root_dir,
@@ -92,20 +165,52 @@ def train_eval(
     env_name='HalfCheetah-v2',
     eval_env_name=None,
     env_load_fn=suite_gym.load,
+    # Loader of the eval envs; defaults to env_load_fn, without the discounted
+    # reward aggregation of load_decimated.
+    eval_env_load_fn=None,
     num_iterations=3000000,
     actor_fc_layers=(256, 256),
+    # dtype of the ActionGenerator, ZInferenceNetwork and VAE loss. Runs made
+    # before this option existed computed in float64 and need it to restore.
+    latent_dtype=tf.float32,
+    # With finetune, fold the pretrained ActionGenerator into constants instead
+    # of keeping it as (untrained) variables.
+    freeze_generator=False,
+    generator_checkpoint=None,
+    # Warm start a fresh run from another run's train checkpoint, restoring
+    # only these networks (see SacAgent.network_checkpoint).
+    init_from=None,
+    init_from_networks=('encoder', 'action_generator'),
     critic_obs_fc_layers=None,
     critic_action_fc_layers=None,
     critic_joint_fc_layers=(256, 256),
+    num_critics=None,
     # Params for collect
+    num_parallel_envs=1,
+    # Step the num_parallel_envs cheetahs of a cheetah running task in one
+    # process with one call per batch (see latent_batched_env).
+    batched_env=False,
+    num_collector_processes=0,
     initial_collect_steps=10000,
     collect_steps_per_iteration=1,
     replay_buffer_capacity=1000000,
+    replay_buffer_backend='tf',
+    replay_buffer_memmap=False,
+    replay_buffer_segmented_checkpoints=False,
+    prioritized_replay=False,
+    replay_snapshot_dir=None,
+    # Capacity of the private overlay next to replay_snapshot_dir; defaults to
+    # the transitions this run collects, capped at replay_buffer_capacity.
+    replay_overlay_capacity=None,
+    # If set, the replay buffer is exported here as columnar shards, adding
+    # new items at every rb_checkpoint_interval and at the end.
+    replay_export_dir=None,
     # Params for target update
     target_update_tau=0.005,
     target_update_period=1,
     # Params for train
     train_steps_per_iteration=1,
+    steps_per_run=1,
     batch_size=256,
     actor_learning_rate=3e-4,
     critic_learning_rate=3e-4,
@@ -114,9 +219,17 @@ def train_eval(
     gamma=0.99,
     reward_scale_factor=1.0,
     gradient_clipping=None,
+    # Optional {component: period or (period, repeats)} for the critic, actor,
+    # alpha, vae and target updates (see SacAgent).
+    update_schedule=None,
     # Params for eval
     num_eval_episodes=30,
+    num_eval_envs=None,
     eval_interval=10000,
+    eval_in_background=False,
+    # Seconds to wait for the background evaluator at the end of training
+    # before terminating it.
+    eval_join_timeout_secs=600,
     # Params for summaries and logging
     train_checkpoint_interval=100000,
     policy_checkpoint_interval=100000,
@@ -124,12 +237,40 @@ def train_eval(
     log_interval=1000,
     plot_interval=100000,
     summary_interval=1000,
+    # Record the agent's loss and update time scalars into graph variables
+    # every step and write their mean/min/max every summary_interval, instead
+    # of fetching summary ops on every train step.
+    aggregate_summaries=False,
     summaries_flush_secs=10,
     debug_summaries=False,
     summarize_grads_and_vars=False,
     eval_metrics_callback=None):
 
   """A simple train and eval for SAC."""
+  if steps_per_run > 1 and num_collector_processes:
+    raise ValueError('steps_per_run > 1 runs collection in-graph and cannot be '
+                     'combined with num_collector_processes.')
+  if replay_snapshot_dir and (replay_buffer_backend != 'numpy' or
+                              prioritized_replay):
+    raise ValueError("replay_snapshot_dir requires replay_buffer_backend="
+                     "'numpy' without prioritized_replay.")
+  if prioritized_replay:
+    if replay_buffer_backend != 'numpy':
+      raise ValueError('prioritized_replay requires replay_buffer_backend='
+                       "'numpy'.")
+    if update_schedule and update_schedule.get('critic', 1) not in (1, (1, 1)):
+      raise ValueError('prioritized_replay needs the TD errors of every train '
+                       'step; the critic cannot skip steps.')
+    # Importance weights need an elementwise loss; mean_squared_error reduces
+    # to a scalar but gives the same unweighted value.
+    if td_errors_loss_fn is tf.compat.v1.losses.mean_squared_error:
+      td_errors_loss_fn = tf.math.squared_difference
+  if batched_env and env_load_fn is not suite_gym.load:
+    raise ValueError('batched_env builds its own cheetah envs and cannot use '
+                     'a custom env_load_fn (e.g. load_decimated).')
+  if eval_env_load_fn is None:
+    eval_env_load_fn = latent_env_wrappers.undiscounted_eval_env_load_fn(
+        env_load_fn)
   root_dir = os.path.expanduser(root_dir)
   train_dir = os.path.join(root_dir, 'train')
   eval_dir = os.path.join(root_dir, 'eval')
@@ -149,30 +290,58 @@ def train_eval(
   global_step = tf.compat.v1.train.get_or_create_global_step()
   with tf.compat.v2.summary.record_if(
       lambda: tf.math.equal(global_step % summary_interval, 0)):
-    # Create the environment.
-    tf_env = tf_py_environment.TFPyEnvironment(env_load_fn(env_name))
+    # Create the environment. With num_parallel_envs > 1 the envs are stepped
+    # in lockstep in subprocesses and every collect step is one batched policy
+    # forward pass over [num_parallel_envs, obs_dim].
+    if batched_env:
+      tf_env = tf_py_environment.TFPyEnvironment(
+          latent_batched_env.BatchedCheetahPyEnvironment(
+              num_parallel_envs,
+              **latent_batched_env.cheetah_env_kwargs(env_name)))
+    elif num_parallel_envs > 1:
+      tf_env = tf_py_environment.TFPyEnvironment(
+          parallel_py_environment.ParallelPyEnvironment(
+              [lambda: env_load_fn(env_name)] * num_parallel_envs))
+    else:
+      tf_env = tf_py_environment.TFPyEnvironment(env_load_fn(env_name))
     eval_env_name = eval_env_name or env_name
-    eval_py_env = env_load_fn(eval_env_name)
+    # Eval episodes run side by side on num_eval_envs envs, one episode each
+    # per round, so every eval step is a single batched policy call.
+    num_eval_envs = num_eval_envs or num_eval_episodes
+    if not eval_in_background:
+      eval_py_env = batched_py_environment.BatchedPyEnvironment(
+          [eval_env_load_fn(eval_env_name) for _ in range(num_eval_envs)])
 
     # Get the data specs from the environment
     time_step_spec = tf_env.time_step_spec()
     observation_spec = time_step_spec.observation
     action_spec = tf_env.action_spec()
     print("Initializing actor network")
-    z_spec = tensor_spec.TensorSpec(shape=[Z_DIM], dtype=tf.dtypes.float64, name='z')
-    action_generator = latent_action_generator.ActionGenerator(input_tensor_spec=(time_step_spec.observation, z_spec))
-    action_generator.create_variables()
-    actor_net = latent_actor_network.ActorDistributionNetwork(
-        observation_spec,
-        action_spec,
-        fc_layer_params=actor_fc_layers,
-        continuous_projection_net=normal_projection_net,
-        action_generator=action_generator)
-    critic_net = critic_network.CriticNetwork(
-        (observation_spec, action_spec),
-        observation_fc_layer_params=critic_obs_fc_layers,
-        action_fc_layer_params=critic_action_fc_layers,
-        joint_fc_layer_params=critic_joint_fc_layers)
+    frozen_generator_weights = None
+    if finetune and freeze_generator:
+      frozen_generator_weights = load_frozen_generator_weights(
+          train_dir, generator_checkpoint or
+          (init_from and resolve_train_checkpoint(init_from)))
+    actor_net, action_generator = create_actor_network(
+        observation_spec, action_spec, actor_fc_layers, latent_dtype,
+        frozen_generator_weights)
+    # num_critics replaces the twin critics with one batched ensemble of that
+    # many members; None keeps the two separate CriticNetworks.
+    if num_critics:
+      critic_net = latent_critic_network.EnsembleCriticNetwork(
+          (observation_spec, action_spec),
+          num_critics=num_critics,
+          observation_fc_layer_params=critic_obs_fc_layers,
+          action_fc_layer_params=critic_action_fc_layers,
+          joint_fc_layer_params=critic_joint_fc_layers)
+    else:
+      critic_net = critic_network.CriticNetwork(
+          (observation_spec, action_spec),
+          observation_fc_layer_params=critic_obs_fc_layers,
+          action_fc_layer_params=critic_action_fc_layers,
+          joint_fc_layer_params=critic_joint_fc_layers)
+    summary_aggregator = (latent_metrics.ScalarAggregator()
+                          if aggregate_summaries else None)
     print("Initializing latent agent")
     tf_agent = latent_agent.SacAgent(
         time_step_spec,
@@ -193,59 +362,158 @@ def train_eval(
         gamma=gamma,
         reward_scale_factor=reward_scale_factor,
         gradient_clipping=gradient_clipping,
+        update_schedule=update_schedule,
+        summary_aggregator=summary_aggregator,
         debug_summaries=debug_summaries,
         summarize_grads_and_vars=summarize_grads_and_vars,
         train_step_counter=global_step)
 
-    # Make the replay buffer.
-    replay_buffer = tf_uniform_replay_buffer.TFUniformReplayBuffer(
-        data_spec=tf_agent.collect_data_spec,
-        batch_size=1,
-        max_length=replay_buffer_capacity)
+    # Make the replay buffer. Each env (or collector process) gets its own row
+    # so that add_batch writes all of their transitions at once; the total
+    # capacity is split evenly across the rows.
+    replay_batch_size = num_collector_processes or tf_env.batch_size
+    if replay_buffer_backend == 'numpy':
+      # Compact columns outside the TF graph, optionally memory-mapped from
+      # files under train_dir so that they do not count against process RAM.
+      replay_buffer_ctor = (latent_replay_buffer.PrioritizedReplayBuffer
+                            if prioritized_replay else
+                            latent_replay_buffer.NumpyReplayBuffer)
+      max_length = replay_buffer_capacity // replay_batch_size
+      if replay_snapshot_dir:
+        # Concurrent finetune jobs map one read-only pretrain snapshot and
+        # only keep their own new transitions privately.
+        replay_buffer_ctor = functools.partial(
+            latent_replay_buffer.SnapshotOverlayReplayBuffer,
+            snapshot_dir=replay_snapshot_dir)
+        if replay_overlay_capacity is None:
+          replay_overlay_capacity = min(
+              replay_buffer_capacity,
+              initial_collect_steps + num_iterations *
+              collect_steps_per_iteration * tf_env.batch_size)
+        max_length = max(1, -(-replay_overlay_capacity // replay_batch_size))
+      replay_buffer = replay_buffer_ctor(
+          data_spec=tf_agent.collect_data_spec,
+          batch_size=replay_batch_size,
+          max_length=max_length,
+          storage_dir=(os.path.join(train_dir, 'replay_buffer_memmap')
+                       if replay_buffer_memmap else None))
+    elif replay_buffer_backend == 'tf':
+      replay_buffer = tf_uniform_replay_buffer.TFUniformReplayBuffer(
+          data_spec=tf_agent.collect_data_spec,
+          batch_size=replay_batch_size,
+          max_length=replay_buffer_capacity // replay_batch_size)
+    else:
+      raise ValueError('Unknown replay_buffer_backend: {}'.format(
+          replay_buffer_backend))
     replay_observer = [replay_buffer.add_batch]
 
-    eval_py_policy = py_tf_policy.PyTFPolicy(
-        greedy_policy.GreedyPolicy(tf_agent.policy))
+    if not eval_in_background:
+      evaluator = latent_eval.BatchedEvaluator(
+          eval_py_env, greedy_policy.GreedyPolicy(tf_agent.policy),
+          eval_metrics)
 
     train_metrics = [
         tf_metrics.NumberOfEpisodes(),
         tf_metrics.EnvironmentSteps(),
-        tf_py_metric.TFPyMetric(py_metrics.AverageReturnMetric()),
-        tf_py_metric.TFPyMetric(py_metrics.AverageEpisodeLengthMetric()),
+        tf_py_metric.TFPyMetric(
+            py_metrics.AverageReturnMetric(batch_size=replay_batch_size)),
+        tf_py_metric.TFPyMetric(
+            py_metrics.AverageEpisodeLengthMetric(
+                batch_size=replay_batch_size)),
     ]
 
-    collect_policy = tf_agent.collect_policy
-    initial_collect_policy = random_tf_policy.RandomTFPolicy(
-        tf_env.time_step_spec(), tf_env.action_spec())
-
-    initial_collect_op = dynamic_step_driver.DynamicStepDriver(
-        tf_env,
-        initial_collect_policy,
-        observers=replay_observer + train_metrics,
-        num_steps=initial_collect_steps).run()
-
-    collect_op = dynamic_step_driver.DynamicStepDriver(
-        tf_env,
-        collect_policy,
-        observers=replay_observer + train_metrics,
-        num_steps=collect_steps_per_iteration).run()
-
-    # Prepare replay buffer as dataset with invalid transitions filtered.
-    def _filter_invalid_transition(trajectories, unused_arg1):
-      return ~trajectories.is_boundary()[0]
-    dataset = replay_buffer.as_dataset(
-        sample_batch_size=5 * batch_size,
-        num_steps=2).unbatch().filter(
-            _filter_invalid_transition).batch(batch_size).prefetch(
-                batch_size * 5)
+    actor_learner = None
+    if num_collector_processes:
+      # Collectors run in their own processes and only hand transitions to
+      # the replay buffer and metrics through actor_learner.drain().
+      actor_learner = latent_actor_learner.ActorLearner(
+          num_collectors=num_collector_processes,
+          env_load_fn=env_load_fn,
+          env_name=env_name,
+          actor_network_fn=functools.partial(
+              create_actor_network, actor_fc_layers=actor_fc_layers,
+              latent_dtype=latent_dtype,
+              frozen_generator_weights=frozen_generator_weights),
+          collect_data_spec=tf_agent.collect_data_spec,
+          variables=actor_net.variables + action_generator.variables,
+          observers=replay_observer + train_metrics,
+          initial_collect_steps=initial_collect_steps)
+
+    if not actor_learner:
+      collect_policy = tf_agent.collect_policy
+      initial_collect_policy = random_tf_policy.RandomTFPolicy(
+          tf_env.time_step_spec(), tf_env.action_spec())
+
+      initial_collect_op = dynamic_step_driver.DynamicStepDriver(
+          tf_env,
+          initial_collect_policy,
+          observers=replay_observer + train_metrics,
+          num_steps=initial_collect_steps).run()
+
+      # The driver counts steps summed over the batch, so one lockstep step
+      # of all envs per iteration needs num_steps scaled by the batch size.
+      collect_driver = dynamic_step_driver.DynamicStepDriver(
+          tf_env,
+          collect_policy,
+          observers=replay_observer + train_metrics,
+          num_steps=collect_steps_per_iteration * tf_env.batch_size)
+      collect_op = collect_driver.run()
+
+    # Prepare replay buffer as dataset of exactly batch_size transitions that
+    # do not cross episode boundaries.
+    dataset = latent_replay_buffer.transition_dataset(replay_buffer, batch_size)
     dataset_iterator = tf.compat.v1.data.make_initializable_iterator(dataset)
-    trajectories, unused_info = dataset_iterator.get_next()
-    train_op = tf_agent.train(trajectories)
 
-    summary_ops = []
-    for train_metric in train_metrics:
-      summary_ops.append(train_metric.tf_summaries(
-          train_step=global_step, step_metrics=train_metrics[:2]))
+    def _train_from_replay():
+      trajectories, info = dataset_iterator.get_next()
+      if not prioritized_replay:
+        return tf_agent.train(trajectories)
+      # Weight the losses by the importance weights and feed the new absolute
+      # TD errors back as priorities of the sampled transitions.
+      loss_info = tf_agent.train(trajectories, weights=info.weights)
+      update_priorities_op = replay_buffer.update_priorities(
+          info.ids, loss_info.extra.td_errors)
+      with tf.control_dependencies([update_priorities_op]):
+        return tf.nest.map_structure(tf.identity, loss_info)
+
+    train_op = _train_from_replay()
+
+    if steps_per_run > 1:
+      # Fuse steps_per_run iterations of collect, replay add, sample and train
+      # into one while_loop so a single Session.run covers all of them. The
+      # agent variables and optimizer slots already exist from train_op above.
+      def _fused_body(i, unused_loss):
+        collect_time_step, _ = collect_driver.run()
+        loss = tf.constant(0.0)
+        for _ in range(train_steps_per_iteration):
+          with tf.control_dependencies(
+              tf.nest.flatten(collect_time_step) + [loss]):
+            loss = _train_from_replay().loss
+        with tf.control_dependencies([loss]):
+          return i + 1, tf.identity(loss)
+
+      # The last run is shorter when num_iterations is not a multiple of
+      # steps_per_run.
+      fused_steps = tf.compat.v1.placeholder_with_default(
+          steps_per_run, shape=(), name='fused_steps')
+      _, fused_loss = tf.while_loop(
+          lambda i, unused_loss: i < fused_steps,
+          _fused_body,
+          [tf.constant(0), tf.constant(0.0)],
+          parallel_iterations=1,
+          back_prop=False)
+
+    # With aggregate_summaries these only run every summary_interval, so they
+    # must not depend on the step being a multiple of it.
+    with tf.compat.v2.summary.record_if(
+        True if aggregate_summaries else
+        lambda: tf.math.equal(global_step % summary_interval, 0)):
+      summary_ops = []
+      for train_metric in train_metrics:
+        summary_ops.append(train_metric.tf_summaries(
+            train_step=global_step, step_metrics=train_metrics[:2]))
+      if summary_aggregator is not None:
+        summary_ops.append(summary_aggregator.flush(step=global_step))
 
     with eval_summary_writer.as_default(), \
          tf.compat.v2.summary.record_if(True):
@@ -261,14 +529,44 @@ def train_eval(
         ckpt_dir=os.path.join(train_dir, 'policy'),
         policy=tf_agent.policy,
         global_step=global_step)
-    rb_checkpointer = common.Checkpointer(
-        ckpt_dir=os.path.join(train_dir, 'replay_buffer'),
-        max_to_keep=1,
-        replay_buffer=replay_buffer)
+    if replay_buffer_backend == 'numpy' and replay_buffer_segmented_checkpoints:
+      # Each save appends only the new items; restore streams in the
+      # background while training starts.
+      rb_checkpointer = latent_replay_buffer.SegmentedReplayCheckpointer(
+          ckpt_dir=os.path.join(train_dir, 'replay_buffer'),
+          replay_buffer=replay_buffer)
+    elif replay_buffer_backend == 'numpy':
+      rb_checkpointer = latent_replay_buffer.NumpyReplayBufferCheckpointer(
+          ckpt_dir=os.path.join(train_dir, 'replay_buffer'),
+          replay_buffer=replay_buffer)
+    else:
+      rb_checkpointer = common.Checkpointer(
+          ckpt_dir=os.path.join(train_dir, 'replay_buffer'),
+          max_to_keep=1,
+          replay_buffer=replay_buffer)
+
+    replay_exporter = None
+    if replay_export_dir:
+      replay_exporter = latent_replay_dataset.ReplayBufferExporter(
+          replay_buffer)
+
+    warm_start_checkpoint = None
+    if init_from and tf.train.latest_checkpoint(train_dir) is None:
+      warm_start_checkpoint = resolve_train_checkpoint(init_from)
+      warm_start_networks = [
+          name for name in init_from_networks
+          if not (name == 'action_generator' and frozen_generator_weights)]
+      warm_start = tf_agent.network_checkpoint(warm_start_networks)
 
     with tf.compat.v1.Session() as sess:
       # Initialize graph.
       train_checkpointer.initialize_or_restore(sess)
+      if warm_start_checkpoint:
+        # Only the selected networks are loaded; the step, optimizer slots,
+        # metrics and replay buffer start fresh.
+        logging.info('Initializing %s from %s.', ', '.join(warm_start_networks),
+                     warm_start_checkpoint)
+        warm_start.restore(warm_start_checkpoint).run_restore_ops(sess)
       rb_checkpointer.initialize_or_restore(sess)
 
       # Initialize training.
@@ -279,23 +577,43 @@ def train_eval(
 
       global_step_val = sess.run(global_step)
 
+      if eval_in_background:
+        # The evaluator follows the policy checkpoints, which are then also
+        # written every eval_interval steps.
+        eval_process, eval_stop_event, eval_results_queue = (
+            latent_eval.start_checkpoint_evaluator(
+                root_dir,
+                eval_env_load_fn,
+                eval_env_name,
+                functools.partial(
+                    create_actor_network, actor_fc_layers=actor_fc_layers,
+                    latent_dtype=latent_dtype,
+                    frozen_generator_weights=frozen_generator_weights),
+                num_eval_episodes=num_eval_episodes,
+                num_eval_envs=num_eval_envs))
+
       if global_step_val == 0:
         # Initial eval of randomly initialized policy
-        metric_utils.compute_summaries(
-            eval_metrics,
-            eval_py_env,
-            eval_py_policy,
-            num_episodes=num_eval_episodes,
-            global_step=global_step_val,
-            callback=eval_metrics_callback,
-            log=True,
-        )
-        sess.run(eval_summary_flush_op)
+        if eval_in_background:
+          policy_checkpointer.save(global_step=global_step_val)
+        else:
+          evaluator.compute_summaries(
+              sess,
+              num_episodes=num_eval_episodes,
+              global_step=global_step_val,
+              callback=eval_metrics_callback,
+              log=True,
+          )
+          sess.run(eval_summary_flush_op)
 
         # Run initial collect.
         logging.info('Global step %d: Running initial collect op.',
                      global_step_val)
-        sess.run(initial_collect_op)
+        if actor_learner:
+          actor_learner.start(sess, global_step_val)
+          actor_learner.wait_for(sess, initial_collect_steps)
+        else:
+          sess.run(initial_collect_op)
 
         # Checkpoint the initial replay buffer contents.
         rb_checkpointer.save(global_step=global_step_val)
@@ -304,9 +622,22 @@ def train_eval(
       else:
         logging.info('Global step %d: Skipping initial collect op.',
                      global_step_val)
+        if actor_learner:
+          actor_learner.start(sess, global_step_val)
 
-      collect_call = sess.make_callable(collect_op)
-      train_step_call = sess.make_callable([train_op, summary_ops])
+      if actor_learner:
+        collect_call = functools.partial(actor_learner.drain, sess)
+      else:
+        collect_call = sess.make_callable(collect_op)
+      # Aggregated summaries are written below every summary_interval, off
+      # the per-step path.
+      step_summary_ops = [] if aggregate_summaries else summary_ops
+      train_step_call = sess.make_callable([train_op, step_summary_ops])
+      if steps_per_run > 1:
+        fused_run_call = sess.make_callable([fused_loss, step_summary_ops],
+                                            feed_list=[fused_steps])
+      if aggregate_summaries:
+        summary_call = sess.make_callable(summary_ops)
       global_step_call = sess.make_callable(global_step)
 
       timed_at_step = global_step_call()
@@ -317,16 +648,41 @@ def train_eval(
           name='global_steps_per_sec', data=steps_per_second_ph,
           step=global_step)
       
+      def _crossed(interval):
+        # True when the last iteration moved past a multiple of interval, so
+        # the periodic checks below also fire when one run covers many steps.
+        return global_step_val // interval > previous_step_val // interval
+
       returnsCache = []
-      for _ in range(num_iterations):
+
+      def _add_background_eval_results(received):
+        # The background evaluator's results feed the same callback and
+        # returns plot as in-process evals.
+        for step, results in received:
+          if eval_metrics_callback is not None:
+            eval_metrics_callback(results, step)
+          returnsCache.append((step, results['AverageReturn']))
+      run_lengths = [steps_per_run] * (num_iterations // steps_per_run)
+      if num_iterations % steps_per_run:
+        run_lengths.append(num_iterations % steps_per_run)
+      for run_length in run_lengths:
         start_time = time.time()
-        collect_call()
-        for _ in range(train_steps_per_iteration):
-          total_loss, _ = train_step_call()
+        previous_step_val = global_step_val
+        if steps_per_run > 1:
+          loss_val, _ = fused_run_call(run_length)
+        else:
+          collect_call()
+          for _ in range(train_steps_per_iteration):
+            total_loss, _ = train_step_call()
+          loss_val = total_loss.loss
         time_acc += time.time() - start_time
         global_step_val = global_step_call()
-        if global_step_val % log_interval == 0:
-          logging.info('step = %d, loss = %f', global_step_val, total_loss.loss)
+        if actor_learner:
+          actor_learner.publish(sess, global_step_val)
+        if aggregate_summaries and _crossed(summary_interval):
+          summary_call()
+        if _crossed(log_interval):
+          logging.info('step = %d, loss = %f', global_step_val, loss_val)
           steps_per_sec = (global_step_val - timed_at_step) / time_acc
           logging.info('%.3f steps/sec', steps_per_sec)
           sess.run(
@@ -335,11 +691,12 @@ def train_eval(
           timed_at_step = global_step_val
           time_acc = 0
 
-        if global_step_val % eval_interval == 0:
-          metrics = metric_utils.compute_summaries(
-              eval_metrics,
-              eval_py_env,
-              eval_py_policy,
+        if eval_in_background:
+          _add_background_eval_results(
+              latent_eval.drain_results(eval_results_queue))
+        if _crossed(eval_interval) and not eval_in_background:
+          metrics = evaluator.compute_summaries(
+              sess,
               num_episodes=num_eval_episodes,
               global_step=global_step_val,
               callback=eval_metrics_callback,
@@ -347,19 +704,29 @@ def train_eval(
           )
           sess.run(eval_summary_flush_op)
           returnsCache.append((global_step_val, metrics["AverageReturn"]))
-        if global_step_val % train_checkpoint_interval == 0:
+        if _crossed(train_checkpoint_interval):
           train_checkpointer.save(global_step=global_step_val)
 
-        if global_step_val % policy_checkpoint_interval == 0:
+        if _crossed(policy_checkpoint_interval) or (
+            eval_in_background and _crossed(eval_interval)):
           policy_checkpointer.save(global_step=global_step_val)
 
-        if global_step_val % rb_checkpoint_interval == 0:
+        if _crossed(rb_checkpoint_interval):
+          if replay_buffer_segmented_checkpoints:
+            # Saves and exports read the buffer, so the streamed restore has
+            # to be complete (and to have succeeded) first.
+            rb_checkpointer.wait_for_restore()
           rb_checkpointer.save(global_step=global_step_val)
+          if replay_exporter:
+            replay_exporter.export(sess, os.path.expanduser(replay_export_dir))
 
-        if global_step_val % plot_interval == 0:
+        if _crossed(plot_interval) and returnsCache:
           print("Plotting returns...") 
           steps, returns = zip(*returnsCache)
-          if finetune:
+          if finetune and not init_from:
+            # Finetuning in a copy of the pretrain dir (as run_latent_cheetah.sh
+            # does) continues from the 3M pretrain steps; --init_from runs
+            # start at step 0.
             steps = [x - 3000000 for x in steps]
           plt.plot(steps, returns)
           plt.ylabel('Average Return')
@@ -368,10 +735,24 @@ def train_eval(
           plt.savefig(FLAGS.root_dir + '/plots/sac' + env_name[:-3] + str(int(global_step_val/1000)) + 'k.png')
           print("Done plotting...")
 
+      if actor_learner:
+        actor_learner.stop()
+      if replay_exporter:
+        if replay_buffer_segmented_checkpoints:
+          rb_checkpointer.wait_for_restore()
+        replay_exporter.export(sess, os.path.expanduser(replay_export_dir))
+      if eval_in_background:
+        # Let the evaluator finish the final checkpoint before returning.
+        _add_background_eval_results(latent_eval.stop_checkpoint_evaluator(
+            eval_process, eval_stop_event, eval_results_queue,
+            timeout_secs=eval_join_timeout_secs))
+
 def main(_):
   tf.compat.v1.enable_resource_variables()
   logging.set_verbosity(logging.INFO)
   gin.parse_config_files_and_bindings(FLAGS.gin_file, FLAGS.gin_param)
+  if FLAGS.init_from:
+    gin.bind_parameter('train_eval.init_from', FLAGS.init_from)
   train_eval(FLAGS.root_dir, FLAGS.finetune)
 
 
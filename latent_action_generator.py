@@ -3,6 +3,7 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import numpy as np
 import tensorflow as tf
 import latent_network_robovat
 
@@ -41,7 +42,16 @@ class ActionGenerator(latent_network_robovat.Network):
 
     def __init__(self,
                  input_tensor_spec,
+                 dtype=tf.float32,
                  name='ActionGenerator'):
+        """Creates the generator.
+
+        Args:
+            input_tensor_spec: A tuple of (observation, z) specs.
+            dtype: The dtype the decoder computes in. Inputs are cast to it
+                and the variables are created with it.
+            name: A string representing the name of the network.
+        """
         super(ActionGenerator, self).__init__(
             input_tensor_spec=input_tensor_spec,
             state_spec = (),
@@ -51,14 +61,145 @@ class ActionGenerator(latent_network_robovat.Network):
         self._dim_z = DIM_Z
         self._dim_fc_z = DIM_FC_Z
         self._dim_fc_action = DIM_FC_ACTION
+        self._dtype = tf.as_dtype(dtype)
+
+    @property
+    def dtype(self):
+        return self._dtype
 
     def call(self, input_tensor, step_type=None, network_states=()):
         del step_type    # unused.
         print("Running action generator")
-        observations = input_tensor[0]
-        zs = input_tensor[1]
+        observations = tf.dtypes.cast(input_tensor[0], dtype=self._dtype)
+        zs = tf.dtypes.cast(input_tensor[1], dtype=self._dtype)
         decoder_input = tf.concat([observations, zs], 1)
         
         return generate_action_single_step(
            decoder_input,
            dim_fc_action=self._dim_fc_action)
+
+
+# Where `train_eval`'s train checkpoints keep the ActionGenerator variables:
+# agent -> actor network -> generator checkpointable -> weights list.
+GENERATOR_CHECKPOINT_PREFIX = (
+    'agent/_actor_network/_action_generator_checkpointable/weights')
+
+
+def load_action_generator_weights(checkpoint_path,
+                                  prefix=GENERATOR_CHECKPOINT_PREFIX):
+    """Reads the ActionGenerator weights out of a train checkpoint.
+
+    Args:
+        checkpoint_path: A checkpoint prefix or a directory holding one, in
+            which case the latest checkpoint is used.
+        prefix: Object path of the generator's weights list in the checkpoint.
+
+    Returns:
+        A list of numpy arrays in the order of `ActionGenerator.variables`.
+
+    Raises:
+        ValueError: If no checkpoint or no generator weights are found.
+    """
+    if tf.io.gfile.isdir(checkpoint_path):
+        checkpoint_dir = checkpoint_path
+        checkpoint_path = tf.train.latest_checkpoint(checkpoint_dir)
+        if checkpoint_path is None:
+            raise ValueError('No checkpoint found in %s' % checkpoint_dir)
+    reader = tf.train.load_checkpoint(checkpoint_path)
+    weights = []
+    while True:
+        key = '%s/%d/.ATTRIBUTES/VARIABLE_VALUE' % (prefix, len(weights))
+        if not reader.has_tensor(key):
+            break
+        weights.append(reader.get_tensor(key))
+    if not weights:
+        raise ValueError(
+            'No ActionGenerator weights under %s in %s' % (
+                prefix, checkpoint_path))
+    return weights
+
+
+class FrozenActionGenerator(object):
+    """An ActionGenerator whose weights are folded into graph constants.
+
+    Used when finetuning with a fixed decoder: the generator creates no
+    variables, so it adds nothing to the optimizers, the checkpoints or the
+    weight broadcasts, and its forward pass reads constants.
+    """
+
+    def __init__(self,
+                 input_tensor_spec,
+                 weights,
+                 dtype=tf.float32,
+                 name='ActionGenerator'):
+        """Creates the generator.
+
+        Args:
+            input_tensor_spec: A tuple of (observation, z) specs.
+            weights: The pretrained weights, a list of arrays in the order of
+                `ActionGenerator.variables`, e.g. as returned by
+                `load_action_generator_weights`.
+            dtype: The dtype the decoder computes in.
+            name: A string representing the name of the network.
+        """
+        self._input_tensor_spec = input_tensor_spec
+        self._name = name
+        self._dtype = tf.as_dtype(dtype)
+        fc_weights, fc_biases, output_weights, output_biases = weights
+        with tf.name_scope(name):
+            self._fc_weights = tf.constant(
+                np.asarray(fc_weights), dtype=self._dtype, name='fc_weights')
+            self._fc_biases = tf.constant(
+                np.asarray(fc_biases), dtype=self._dtype, name='fc_biases')
+            self._output_weights = tf.constant(
+                np.asarray(output_weights), dtype=self._dtype,
+                name='output_weights')
+            self._output_biases = tf.constant(
+                np.asarray(output_biases), dtype=self._dtype,
+                name='output_biases')
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def input_tensor_spec(self):
+        return self._input_tensor_spec
+
+    @property
+    def state_spec(self):
+        return ()
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def built(self):
+        return True
+
+    @property
+    def variables(self):
+        return []
+
+    @property
+    def trainable_variables(self):
+        return []
+
+    @property
+    def checkpointable(self):
+        return None
+
+    def create_variables(self):
+        pass
+
+    def __call__(self, input_tensor, step_type=None, network_states=()):
+        del step_type    # unused.
+        observations = tf.dtypes.cast(input_tensor[0], dtype=self._dtype)
+        zs = tf.dtypes.cast(input_tensor[1], dtype=self._dtype)
+        with tf.name_scope(self._name):
+            net = tf.concat([observations, zs], 1)
+            net = tf.nn.relu(tf.matmul(net, self._fc_weights) + self._fc_biases)
+            actions = tf.matmul(net, self._output_weights) + self._output_biases
+            return tf.identity(tf.tanh(actions / 5.0) * 5.0,
+                               'softly_clipped_starts')
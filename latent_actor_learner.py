@@ -0,0 +1,363 @@
+"""Decoupled actor/learner collection for the latent SAC agent.
+
+K collector processes each own a copy of the environment and of the actor
+network. They push transitions through per-collector shared-memory rings and
+refresh their weights from a shared-memory parameter block that the learner
+publishes periodically. The learner drains the rings into its replay buffer
+in one session call and otherwise runs gradient steps without waiting on the
+environment.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ctypes
+import multiprocessing
+import time
+
+import gin
+import numpy as np
+import tensorflow as tf
+
+from absl import logging
+
+import latent_actor_policy
+from tf_agents.specs import tensor_spec
+from tf_agents.trajectories import policy_step
+from tf_agents.trajectories import trajectory
+
+
+class SharedTransitionRing(object):
+  """Single-producer/single-consumer ring of transitions in shared memory.
+
+  Every flattened field of the trajectory spec gets its own `RawArray` of
+  `capacity` slots. The producer writes a slot and then advances `head`, the
+  consumer copies slots out and then advances `tail`, so no lock is needed.
+  """
+
+  def __init__(self, specs, capacity, ctx):
+    """Creates the ring.
+
+    Args:
+      specs: A flat list of `ArraySpec`s, one per trajectory field.
+      capacity: Number of transitions the ring can hold.
+      ctx: A multiprocessing context used to allocate the shared memory.
+    """
+    self._shapes = [tuple(spec.shape) for spec in specs]
+    self._dtypes = [np.dtype(spec.dtype) for spec in specs]
+    self._capacity = capacity
+    self._buffers = [
+        ctx.RawArray(ctypes.c_char,
+                     capacity * max(dtype.itemsize * int(np.prod(shape)), 1))
+        for shape, dtype in zip(self._shapes, self._dtypes)]
+    self._head = ctx.RawValue(ctypes.c_longlong, 0)
+    self._tail = ctx.RawValue(ctypes.c_longlong, 0)
+    self._arrays = None
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['_arrays'] = None
+    return state
+
+  def _views(self):
+    if self._arrays is None:
+      self._arrays = [
+          np.frombuffer(buf, dtype=dtype).reshape((self._capacity,) + shape)
+          for buf, shape, dtype in zip(self._buffers, self._shapes,
+                                       self._dtypes)]
+    return self._arrays
+
+  def size(self):
+    return self._head.value - self._tail.value
+
+  def put(self, flat_transition, stop_event=None):
+    """Writes one transition, blocking while the ring is full."""
+    while self.size() >= self._capacity:
+      if stop_event is not None and stop_event.is_set():
+        return False
+      time.sleep(0.001)
+    slot = self._head.value % self._capacity
+    for array, value in zip(self._views(), flat_transition):
+      array[slot] = value
+    self._head.value += 1
+    return True
+
+  def get(self, num_items):
+    """Copies out the `num_items` oldest transitions as [num_items, ...]."""
+    slots = (self._tail.value + np.arange(num_items)) % self._capacity
+    items = [np.take(array, slots, axis=0) for array in self._views()]
+    self._tail.value += num_items
+    return items
+
+
+class SharedWeights(object):
+  """Actor weights broadcast from the learner through shared memory."""
+
+  def __init__(self, shapes, ctx):
+    self._shapes = [tuple(shape) for shape in shapes]
+    self._sizes = [int(np.prod(shape)) for shape in self._shapes]
+    self._buffer = ctx.RawArray(ctypes.c_double, max(sum(self._sizes), 1))
+    self._lock = ctx.Lock()
+    self._version = ctx.RawValue(ctypes.c_longlong, 0)
+    self._train_step = ctx.RawValue(ctypes.c_longlong, 0)
+
+  @property
+  def version(self):
+    return self._version.value
+
+  @property
+  def train_step(self):
+    return self._train_step.value
+
+  def publish(self, values, train_step):
+    flat = np.frombuffer(self._buffer, dtype=np.float64)
+    with self._lock:
+      offset = 0
+      for value, size in zip(values, self._sizes):
+        flat[offset:offset + size] = np.reshape(value, [-1])
+        offset += size
+      self._train_step.value = train_step
+      self._version.value += 1
+
+  def read(self):
+    """Returns (values, version, train_step) from one consistent snapshot."""
+    flat = np.frombuffer(self._buffer, dtype=np.float64)
+    with self._lock:
+      flat = flat.copy()
+      version = self._version.value
+      train_step = self._train_step.value
+    values = []
+    offset = 0
+    for shape, size in zip(self._shapes, self._sizes):
+      values.append(flat[offset:offset + size].reshape(shape))
+      offset += size
+    return values, version, train_step
+
+
+def _collector_main(collector_id, env_load_fn, env_name, actor_network_fn,
+                    gin_config, ring, weights, stop_event,
+                    initial_random_steps, max_weight_staleness):
+  """Steps one environment with a periodically refreshed actor."""
+  gin.parse_config(gin_config)
+  tf.compat.v1.enable_resource_variables()
+  np.random.seed(collector_id)
+  py_env = env_load_fn(env_name)
+  py_env.seed(collector_id)
+
+  time_step_spec = tensor_spec.from_spec(py_env.time_step_spec())
+  action_spec = tensor_spec.from_spec(py_env.action_spec())
+  actor_net, action_generator = actor_network_fn(
+      time_step_spec.observation, action_spec)
+  policy = latent_actor_policy.ActorPolicy(
+      time_step_spec=time_step_spec,
+      action_spec=action_spec,
+      actor_network=actor_net,
+      training=False)
+  time_step_ph = tensor_spec.to_nest_placeholder(
+      time_step_spec, outer_dims=[1])
+  action_op = policy.action(time_step_ph).action
+
+  variables = actor_net.variables + action_generator.variables
+  weight_phs = [tf.compat.v1.placeholder(v.dtype.base_dtype, v.shape)
+                for v in variables]
+  assign_op = tf.group(*[v.assign(ph) for v, ph in zip(variables, weight_phs)])
+
+  py_action_spec = py_env.action_spec()
+  with tf.compat.v1.Session() as sess:
+    sess.run(tf.compat.v1.global_variables_initializer())
+    local_version = -1
+    local_train_step = -1
+    num_steps = 0
+    # Envs may return the same observation array on every call (see
+    # CheetahEnv's reuse_buffers), so the time step kept across `step` is a
+    # copy.
+    time_step = tf.nest.map_structure(np.copy, py_env.reset())
+    while not stop_event.is_set():
+      # Always load the first broadcast (published by `start` before the
+      # collectors launch), so they never act with their own random init.
+      if weights.version != local_version and (
+          local_version < 0 or
+          weights.train_step - local_train_step > max_weight_staleness):
+        values, local_version, local_train_step = weights.read()
+        sess.run(assign_op, feed_dict=dict(zip(weight_phs, values)))
+
+      if num_steps < initial_random_steps:
+        action = np.random.uniform(
+            py_action_spec.minimum, py_action_spec.maximum,
+            py_action_spec.shape).astype(py_action_spec.dtype)
+      else:
+        feed_dict = dict(zip(
+            tf.nest.flatten(time_step_ph),
+            [np.expand_dims(t, 0) for t in tf.nest.flatten(time_step)]))
+        action = sess.run(action_op, feed_dict=feed_dict)[0]
+
+      next_time_step = py_env.step(action)
+      traj = trajectory.from_transition(
+          time_step, policy_step.PolicyStep(action, (), ()), next_time_step)
+      if not ring.put(tf.nest.flatten(traj), stop_event):
+        break
+      time_step = tf.nest.map_structure(np.copy, next_time_step)
+      num_steps += 1
+  py_env.close()
+
+
+@gin.configurable
+class ActorLearner(object):
+  """Runs K collector processes and drains their transitions in the learner.
+
+  The collectors push into one ring each, so the learner's replay buffer has
+  one row per collector and `drain` writes K transitions per time index.
+  """
+
+  def __init__(self,
+               num_collectors,
+               env_load_fn,
+               env_name,
+               actor_network_fn,
+               collect_data_spec,
+               variables,
+               observers,
+               initial_collect_steps=0,
+               ring_capacity=10000,
+               max_drain_steps=1000,
+               weight_publish_interval=100,
+               max_weight_staleness=1000):
+    """Builds the shared buffers and the in-graph drain op.
+
+    Args:
+      num_collectors: Number of collector processes K.
+      env_load_fn: Picklable function that creates the py environment.
+      env_name: Name passed to `env_load_fn`.
+      actor_network_fn: Picklable function
+        `actor_network_fn(observation_spec, action_spec)` returning the
+        `(actor_network, action_generator)` pair used by the collectors.
+      collect_data_spec: The agent's trajectory spec.
+      variables: Learner variables broadcast to the collectors, in the same
+        order as `actor_network.variables + action_generator.variables`.
+      observers: Observers called on every drained [K]-batched trajectory,
+        typically the replay buffer's `add_batch` and the train metrics.
+      initial_collect_steps: Total number of uniformly random steps taken by
+        the collectors before they switch to the actor.
+      ring_capacity: Transitions buffered per collector before it blocks.
+      max_drain_steps: Maximum time indices written per `drain` call.
+      weight_publish_interval: Train steps between weight broadcasts.
+      max_weight_staleness: A collector refreshes its weights once the newest
+        broadcast is more than this many train steps ahead of its copy. As
+        broadcasts only happen every `weight_publish_interval` steps, a
+        collector's weights can lag the learner by up to
+        `max_weight_staleness + weight_publish_interval` train steps.
+    """
+    self._ctx = multiprocessing.get_context('spawn')
+    self._num_collectors = num_collectors
+    self._env_load_fn = env_load_fn
+    self._env_name = env_name
+    self._actor_network_fn = actor_network_fn
+    self._initial_random_steps = initial_collect_steps // num_collectors
+    self._max_drain_steps = max_drain_steps
+    self._weight_publish_interval = weight_publish_interval
+    self._max_weight_staleness = max_weight_staleness
+    self._variables = variables
+    self._processes = []
+    self._last_publish_step = None
+    self._num_drained = 0
+
+    flat_specs = tf.nest.flatten(
+        tensor_spec.to_nest_array_spec(collect_data_spec))
+    self._rings = [SharedTransitionRing(flat_specs, ring_capacity, self._ctx)
+                   for _ in range(num_collectors)]
+    self._weights = SharedWeights(
+        [v.shape.as_list() for v in variables], self._ctx)
+    self._stop_event = self._ctx.Event()
+
+    # Drained transitions arrive as [T, K, ...] and are handed to the
+    # observers one time index at a time inside a single session call.
+    self._drain_ph = tensor_spec.to_nest_placeholder(
+        collect_data_spec, outer_dims=[None, num_collectors])
+
+    def _drain_body(i):
+      traj = tf.nest.map_structure(lambda t: t[i], self._drain_ph)
+      observer_ops = [observer(traj) for observer in observers]
+      with tf.control_dependencies(tf.nest.flatten(observer_ops)):
+        return i + 1
+
+    num_items = tf.shape(tf.nest.flatten(self._drain_ph)[0])[0]
+    self._drain_op = tf.while_loop(
+        lambda i: i < num_items, _drain_body, [tf.constant(0)],
+        parallel_iterations=1, back_prop=False)
+
+  @property
+  def num_collectors(self):
+    return self._num_collectors
+
+  def start(self, sess, train_step):
+    """Publishes the initial weights and launches the collectors."""
+    self.publish(sess, train_step, force=True)
+    gin_config = gin.config_str()
+    for collector_id, ring in enumerate(self._rings):
+      process = self._ctx.Process(
+          target=_collector_main,
+          args=(collector_id, self._env_load_fn, self._env_name,
+                self._actor_network_fn, gin_config, ring, self._weights,
+                self._stop_event, self._initial_random_steps,
+                self._max_weight_staleness))
+      process.daemon = True
+      process.start()
+      self._processes.append(process)
+    logging.info('Started %d collector processes.', self._num_collectors)
+
+  def stop(self):
+    self._stop_event.set()
+    for process in self._processes:
+      process.join(timeout=10)
+      if process.is_alive():
+        process.terminate()
+    self._processes = []
+
+  def publish(self, sess, train_step, force=False):
+    """Broadcasts the learner weights every `weight_publish_interval`."""
+    if (not force and self._last_publish_step is not None and
+        train_step - self._last_publish_step < self._weight_publish_interval):
+      return
+    self._weights.publish(sess.run(self._variables), train_step)
+    self._last_publish_step = train_step
+
+  def _check_collectors(self):
+    """Raises if a collector process exited while the learner needs it."""
+    for collector_id, process in enumerate(self._processes):
+      if not process.is_alive():
+        raise RuntimeError('Collector %d exited with code %s.' %
+                           (collector_id, process.exitcode))
+
+  def drain(self, sess):
+    """Moves the transitions available in every ring into the observers.
+
+    Returns:
+      The number of transitions written, summed over collectors.
+    Raises:
+      RuntimeError: If no transitions are available and a collector process
+        has exited.
+    """
+    num_items = min(min(ring.size() for ring in self._rings),
+                    self._max_drain_steps)
+    if num_items == 0:
+      self._check_collectors()
+      return 0
+    # Each ring yields [T, ...]; stack on axis 1 to get [T, K, ...].
+    per_ring = [ring.get(num_items) for ring in self._rings]
+    flat_items = [np.stack(fields, axis=1) for fields in zip(*per_ring)]
+    sess.run(self._drain_op, feed_dict=dict(zip(
+        tf.nest.flatten(self._drain_ph), flat_items)))
+    self._num_drained += num_items * self._num_collectors
+    return num_items * self._num_collectors
+
+  def wait_for(self, sess, num_transitions):
+    """Drains until at least `num_transitions` have been written.
+
+    Raises:
+      RuntimeError: If a collector process exits before then.
+    """
+    while self._num_drained < num_transitions:
+      self._check_collectors()
+      if not self.drain(sess):
+        time.sleep(0.01)
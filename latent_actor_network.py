@@ -137,6 +137,8 @@ class ActorDistributionNetwork(network.DistributionNetwork):
 
     self._encoder = encoder
     self._action_generator = action_generator
+    # Track the slim generator variables so policy checkpoints include them.
+    self._action_generator_checkpointable = action_generator.checkpointable
     self._projection_networks = projection_networks
     self._output_tensor_spec = output_tensor_spec
 
@@ -151,7 +153,8 @@ class ActorDistributionNetwork(network.DistributionNetwork):
         network_state=network_state,
         training=training)
     outer_rank = nest_utils.get_outer_rank(observations, self.input_tensor_spec)
-    zs = tf.dtypes.cast(enc_output, dtype=tf.float64)
+    # Both casts are no-ops when the generator computes in float32.
+    zs = tf.dtypes.cast(enc_output, dtype=self._action_generator.dtype)
     #zs = self.project_to_zdim()
     state = self._action_generator((observations, zs))
     state = tf.dtypes.cast(state, dtype=tf.float32)
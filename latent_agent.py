@@ -15,12 +15,31 @@ from tf_agents.trajectories import trajectory
 from tf_agents.utils import common
 from tf_agents.utils import eager_utils
 from tf_agents.utils import nest_utils
+import latent_critic_network
 import latent_inference_network
 
 EPS = 1e-20
 
 SacLossInfo = collections.namedtuple(
-    'SacLossInfo', ('critic_loss', 'actor_loss', 'alpha_loss'))
+    'SacLossInfo', ('critic_loss', 'actor_loss', 'alpha_loss', 'td_errors'))
+
+UPDATE_COMPONENTS = ('critic', 'actor', 'alpha', 'vae', 'target')
+
+
+def _parse_update_schedule(update_schedule, target_update_period):
+  """Returns {component: (period, repeats)} for every update component."""
+  schedule = {name: (1, 1) for name in UPDATE_COMPONENTS}
+  schedule['target'] = (target_update_period, 1)
+  for name, value in update_schedule.items():
+    if name not in schedule:
+      raise ValueError('Unknown update component %r; expected one of %s.' %
+                       (name, ', '.join(UPDATE_COMPONENTS)))
+    period, repeats = (value, 1) if isinstance(value, int) else value
+    if period < 1 or repeats < 1:
+      raise ValueError('Update period and repeats must be positive, got %r '
+                       'for %r.' % (value, name))
+    schedule[name] = (int(period), int(repeats))
+  return schedule
 
 
 @gin.configurable
@@ -56,6 +75,9 @@ class SacAgent(tf_agent.TFAgent):
                initial_log_alpha=0.0,
                target_entropy=None,
                gradient_clipping=None,
+               fused_train_step=False,
+               update_schedule=None,
+               summary_aggregator=None,
                debug_summaries=False,
                summarize_grads_and_vars=False,
                train_step_counter=None,
@@ -65,7 +87,10 @@ class SacAgent(tf_agent.TFAgent):
       time_step_spec: A `TimeStep` spec of the expected time_steps.
       action_spec: A nest of BoundedTensorSpec representing the actions.
       critic_network: A function critic_network((observations, actions)) that
-        returns the q_values for each observation and action.
+        returns the q_values for each observation and action. If it is a
+        `latent_critic_network.EnsembleCriticNetwork`, it replaces the twin
+        critics: all of its members are evaluated in one call and
+        `critic_network_2`/`target_critic_network_2` are ignored.
       actor_network: A function actor_network(observation, action_spec) that
         returns action distribution.
       actor_optimizer: The optimizer to use for the actor network.
@@ -103,6 +128,22 @@ class SacAgent(tf_agent.TFAgent):
       target_entropy: The target average policy entropy, for updating alpha. The
         default value is negative of the total number of actions.
       gradient_clipping: Norm length to clip gradients.
+      fused_train_step: If True, compute the critic, actor, alpha and VAE
+        losses from one forward pass under a single tape, sharing the sampled
+        actions and log-probs of the current states between the actor and
+        alpha losses.
+      update_schedule: Optional dict from component ('critic', 'actor',
+        'alpha', 'vae', 'target') to its update period in train steps, or to
+        a (period, repeats) pair where repeats is the number of gradient steps
+        taken on the batch when the component is due. Components that are not
+        due are skipped in the graph, and the time spent in every component
+        is written as an `UpdateTime/<component>` summary (recorded as
+        `UpdateTime/<component>/mean|min|max` with a `summary_aggregator`).
+        Missing components update every step; the target defaults to
+        `target_update_period`.
+      summary_aggregator: Optional `latent_metrics.ScalarAggregator`. If set,
+        the loss and update time scalars are recorded into it every step
+        instead of being written as summaries.
       debug_summaries: A bool to gather debug summaries.
       summarize_grads_and_vars: If True, gradient and network variable summaries
         will be written during training.
@@ -120,28 +161,39 @@ class SacAgent(tf_agent.TFAgent):
             'SacAgent does not currently support discrete actions. '
             'Action spec: {}'.format(action_spec))
 
-    self._critic_network_1 = critic_network
-    self._critic_network_1.create_variables()
-    if target_critic_network:
-      target_critic_network.create_variables()
-    self._target_critic_network_1 = (
-        common.maybe_copy_target_network_with_checks(self._critic_network_1,
-                                                     target_critic_network,
-                                                     'TargetCriticNetwork1'))
-
-    if critic_network_2 is not None:
-      self._critic_network_2 = critic_network_2
+    if isinstance(critic_network, latent_critic_network.EnsembleCriticNetwork):
+      self._critic_ensemble = critic_network
+      self._critic_ensemble.create_variables()
+      if target_critic_network:
+        target_critic_network.create_variables()
+      self._target_critic_ensemble = (
+          common.maybe_copy_target_network_with_checks(
+              self._critic_ensemble, target_critic_network,
+              'TargetCriticEnsemble'))
     else:
-      self._critic_network_2 = critic_network.copy(name='CriticNetwork2')
-      # Do not use target_critic_network_2 if critic_network_2 is None.
-      target_critic_network_2 = None
-    self._critic_network_2.create_variables()
-    if target_critic_network_2:
-      target_critic_network_2.create_variables()
-    self._target_critic_network_2 = (
-        common.maybe_copy_target_network_with_checks(self._critic_network_2,
-                                                     target_critic_network_2,
-                                                     'TargetCriticNetwork2'))
+      self._critic_ensemble = None
+      self._critic_network_1 = critic_network
+      self._critic_network_1.create_variables()
+      if target_critic_network:
+        target_critic_network.create_variables()
+      self._target_critic_network_1 = (
+          common.maybe_copy_target_network_with_checks(self._critic_network_1,
+                                                       target_critic_network,
+                                                       'TargetCriticNetwork1'))
+
+      if critic_network_2 is not None:
+        self._critic_network_2 = critic_network_2
+      else:
+        self._critic_network_2 = critic_network.copy(name='CriticNetwork2')
+        # Do not use target_critic_network_2 if critic_network_2 is None.
+        target_critic_network_2 = None
+      self._critic_network_2.create_variables()
+      if target_critic_network_2:
+        target_critic_network_2.create_variables()
+      self._target_critic_network_2 = (
+          common.maybe_copy_target_network_with_checks(self._critic_network_2,
+                                                       target_critic_network_2,
+                                                       'TargetCriticNetwork2'))
     print("Creating actor network variables")
     if actor_network:
       actor_network.create_variables()
@@ -185,15 +237,34 @@ class SacAgent(tf_agent.TFAgent):
     self._reward_scale_factor = reward_scale_factor
     self._target_entropy = target_entropy
     self._gradient_clipping = gradient_clipping
+    self._fused_train_step = fused_train_step
+    self._update_schedule = None
+    if update_schedule is not None:
+      if fused_train_step:
+        raise ValueError('update_schedule cannot be combined with '
+                         'fused_train_step.')
+      self._update_schedule = _parse_update_schedule(
+          update_schedule, target_update_period)
+      # The schedule decides when the target is due.
+      self._target_update_period = 1
+    self._summary_aggregator = summary_aggregator
     self._debug_summaries = debug_summaries
     self._summarize_grads_and_vars = summarize_grads_and_vars
     self._update_target = self._get_target_updater(
         tau=self._target_update_tau, period=self._target_update_period)
     self._action_generator = action_generator
     
-    z_inference_network_ctor = latent_inference_network.ZInferenceNetwork
-    self._z_inference_network = z_inference_network_ctor(input_tensor_spec=(time_step_spec.observation, action_spec))
-    self._z_inference_network.create_variables() 
+    # The inference network is only used by the VAE update, which finetuning
+    # skips, so it is not built at all then.
+    self._z_inference_network = None
+    if not finetune:
+      z_inference_network_ctor = latent_inference_network.ZInferenceNetwork
+      self._z_inference_network = z_inference_network_ctor(
+          input_tensor_spec=(time_step_spec.observation, action_spec),
+          dtype=action_generator.dtype)
+      self._z_inference_network.create_variables() 
+      self._z_inference_network_checkpointable = (
+          self._z_inference_network.checkpointable)
     train_sequence_length = 2 if not critic_network.state_spec else None
 
     super(SacAgent, self).__init__(
@@ -210,14 +281,74 @@ class SacAgent(tf_agent.TFAgent):
     """Returns an op to initialize the agent.
     Copies weights from the Q networks to the target Q network.
     """
-    common.soft_variables_update(
-        self._critic_network_1.variables,
-        self._target_critic_network_1.variables,
-        tau=1.0)
-    common.soft_variables_update(
-        self._critic_network_2.variables,
-        self._target_critic_network_2.variables,
-        tau=1.0)
+    for critic, target_critic in self._critic_and_target_networks():
+      common.soft_variables_update(
+          critic.variables, target_critic.variables, tau=1.0)
+
+  def _critic_and_target_networks(self):
+    """Returns (critic, target critic) network pairs."""
+    if self._critic_ensemble is not None:
+      return [(self._critic_ensemble, self._target_critic_ensemble)]
+    return [(self._critic_network_1, self._target_critic_network_1),
+            (self._critic_network_2, self._target_critic_network_2)]
+
+  def _critic_q_values(self, inputs, step_type, training, target=False):
+    """Evaluates every critic (or target critic) as a [num_critics, B] tensor."""
+    networks = [pair[1] if target else pair[0]
+                for pair in self._critic_and_target_networks()]
+    if self._critic_ensemble is not None:
+      q_values, _ = networks[0](inputs, step_type, training=training)
+      return q_values
+    return tf.stack([network(inputs, step_type, training=training)[0]
+                     for network in networks])
+
+  def _critic_variables(self):
+    return sum([critic.trainable_variables
+                for critic, _ in self._critic_and_target_networks()], [])
+
+  def network_checkpoint(self, networks):
+    """Returns a `tf.train.Checkpoint` over only the selected sub-networks.
+
+    Its object graph mirrors the `agent` entry of the train checkpoints written
+    by `train_eval`, so restoring a train checkpoint through it loads just the
+    selected networks and leaves optimizer slots, counters and metrics alone.
+
+    Args:
+      networks: Names out of 'encoder', 'projection', 'action_generator',
+        'z_inference' and 'critics'. 'critics' includes the target critics.
+    Raises:
+      ValueError: If a name is unknown or the network is not part of this
+        agent (e.g. the generator is frozen or there is no inference network).
+    """
+    actor_network = tf.Module(name='ActorNetworkMirror')
+    agent = tf.Module(name='AgentMirror')
+    agent._actor_network = actor_network
+    for network_name in networks:
+      if network_name == 'encoder':
+        actor_network._encoder = self._actor_network._encoder
+      elif network_name == 'projection':
+        actor_network._projection_networks = (
+            self._actor_network._projection_networks)
+      elif (network_name == 'action_generator' and
+            self._actor_network._action_generator_checkpointable is not None):
+        actor_network._action_generator_checkpointable = (
+            self._actor_network._action_generator_checkpointable)
+      elif (network_name == 'z_inference' and
+            self._z_inference_network is not None):
+        agent._z_inference_network_checkpointable = (
+            self._z_inference_network_checkpointable)
+      elif network_name == 'critics' and self._critic_ensemble is not None:
+        agent._critic_ensemble = self._critic_ensemble
+        agent._target_critic_ensemble = self._target_critic_ensemble
+      elif network_name == 'critics':
+        agent._critic_network_1 = self._critic_network_1
+        agent._critic_network_2 = self._critic_network_2
+        agent._target_critic_network_1 = self._target_critic_network_1
+        agent._target_critic_network_2 = self._target_critic_network_2
+      else:
+        raise ValueError('Cannot select network %r for restoring.' %
+                         network_name)
+    return tf.train.Checkpoint(agent=agent)
 
   def _experience_to_transitions(self, experience):
     transitions = trajectory.to_transition(experience)
@@ -247,14 +378,18 @@ class SacAgent(tf_agent.TFAgent):
     print("Running train forward pass")
     time_steps, actions, next_time_steps = self._experience_to_transitions(
         experience)
-    trainable_critic_variables = (
-        self._critic_network_1.trainable_variables +
-        self._critic_network_2.trainable_variables)
+    if self._fused_train_step:
+      return self._fused_train(time_steps, actions, next_time_steps, weights)
+    if self._update_schedule is not None:
+      return self._scheduled_train(time_steps, actions, next_time_steps,
+                                   weights)
+
+    trainable_critic_variables = self._critic_variables()
     with tf.GradientTape(watch_accessed_variables=False) as tape:
       assert trainable_critic_variables, ('No trainable critic variables to '
                                           'optimize.')
       tape.watch(trainable_critic_variables)
-      critic_loss = self.critic_loss(
+      critic_loss, td_errors = self._critic_loss_and_td_errors(
           time_steps,
           actions,
           next_time_steps,
@@ -301,28 +436,225 @@ class SacAgent(tf_agent.TFAgent):
       tf.debugging.check_numerics(vae_loss, 'VAE loss is inf or nan.')
       vae_grads = tape.gradient(vae_loss, vae_variables)
       self._apply_gradients(vae_grads, vae_variables, self._actor_optimizer) 
+    else:
+      vae_loss = None
 
-    with tf.name_scope('Losses'):
-      tf.compat.v2.summary.scalar(
-          name='critic_loss', data=critic_loss, step=self.train_step_counter)
-      tf.compat.v2.summary.scalar(
-          name='actor_loss', data=actor_loss, step=self.train_step_counter)
-      tf.compat.v2.summary.scalar(
-          name='alpha_loss', data=alpha_loss, step=self.train_step_counter)
+    return self._finish_train(critic_loss, actor_loss, alpha_loss, vae_loss,
+                              td_errors)
 
-    self.train_step_counter.assign_add(1)
-    self._update_target()
+  def _fused_train(self, time_steps, actions, next_time_steps, weights):
+    """Single-pass variant of `_train`.
+
+    Every forward pass runs once per batch under one persistent tape: the
+    critics and target critics, the actor on the next states (for the TD
+    targets), the actor on the current states (shared by the actor and alpha
+    losses) and the VAE. Each variable group then takes the gradient of its
+    own loss only; the TD targets and the alpha entropy term are already
+    stop-gradients.
+    """
+    trainable_critic_variables = self._critic_variables()
+    trainable_actor_variables = [
+        var for var in self._actor_network.trainable_variables
+        if var not in self._action_generator.trainable_variables]
+    alpha_variable = [self._log_alpha]
+    vae_variables = []
     if not self._finetune:
+      vae_variables = (self._z_inference_network.trainable_variables +
+                       self._action_generator.trainable_variables)
+
+    with tf.GradientTape(watch_accessed_variables=False,
+                         persistent=True) as tape:
+      tape.watch(trainable_critic_variables + trainable_actor_variables +
+                 alpha_variable + vae_variables)
+      critic_loss, td_errors = self._critic_loss_and_td_errors(
+          time_steps,
+          actions,
+          next_time_steps,
+          td_errors_loss_fn=self._td_errors_loss_fn,
+          gamma=self._gamma,
+          reward_scale_factor=self._reward_scale_factor,
+          weights=weights)
+      actions_and_log_pi = self._actions_and_log_probs(time_steps)
+      actor_loss = self.actor_loss(
+          time_steps, weights=weights, actions_and_log_pi=actions_and_log_pi)
+      alpha_loss = self.alpha_loss(
+          time_steps, weights=weights, actions_and_log_pi=actions_and_log_pi)
+      vae_loss = None
+      if vae_variables:
+        vae_loss = self.vae_loss(time_steps, actions, next_time_steps)
+
+    tf.debugging.check_numerics(critic_loss, 'Critic loss is inf or nan.')
+    tf.debugging.check_numerics(actor_loss, 'Actor loss is inf or nan.')
+    tf.debugging.check_numerics(alpha_loss, 'Alpha loss is inf or nan.')
+    updates = [
+        (critic_loss, trainable_critic_variables, self._critic_optimizer),
+        (actor_loss, trainable_actor_variables, self._actor_optimizer),
+        (alpha_loss, alpha_variable, self._alpha_optimizer),
+    ]
+    if vae_loss is not None:
+      tf.debugging.check_numerics(vae_loss, 'VAE loss is inf or nan.')
+      updates.append((vae_loss, vae_variables, self._actor_optimizer))
+    # Take every gradient before applying any update so all of them see the
+    # same weights.
+    grads = [tape.gradient(loss, variables) for loss, variables, _ in updates]
+    del tape
+    for (_, variables, optimizer), variable_grads in zip(updates, grads):
+      self._apply_gradients(variable_grads, variables, optimizer)
+
+    return self._finish_train(critic_loss, actor_loss, alpha_loss, vae_loss,
+                              td_errors)
+
+  def _scheduled_train(self, time_steps, actions, next_time_steps, weights):
+    """Variant of `_train` that follows `update_schedule`.
+
+    Components run one after the other in the order of `UPDATE_COMPONENTS`,
+    each inside a `tf.cond` on the train step, so a component that is not due
+    costs neither its forward nor its backward pass.
+    """
+    trainable_critic_variables = self._critic_variables()
+    trainable_actor_variables = [
+        var for var in self._actor_network.trainable_variables
+        if var not in self._action_generator.trainable_variables]
+    alpha_variable = [self._log_alpha]
+
+    def _critic_update():
+      with tf.GradientTape(watch_accessed_variables=False) as tape:
+        tape.watch(trainable_critic_variables)
+        critic_loss, td_errors = self._critic_loss_and_td_errors(
+            time_steps,
+            actions,
+            next_time_steps,
+            td_errors_loss_fn=self._td_errors_loss_fn,
+            gamma=self._gamma,
+            reward_scale_factor=self._reward_scale_factor,
+            weights=weights)
+      tf.debugging.check_numerics(critic_loss, 'Critic loss is inf or nan.')
+      train_op = self._apply_gradients(
+          tape.gradient(critic_loss, trainable_critic_variables),
+          trainable_critic_variables, self._critic_optimizer)
+      with tf.control_dependencies([train_op]):
+        return tf.identity(critic_loss), tf.identity(td_errors)
+
+    def _actor_update():
+      with tf.GradientTape(watch_accessed_variables=False) as tape:
+        tape.watch(trainable_actor_variables)
+        actor_loss = self.actor_loss(time_steps, weights=weights)
+      tf.debugging.check_numerics(actor_loss, 'Actor loss is inf or nan.')
+      train_op = self._apply_gradients(
+          tape.gradient(actor_loss, trainable_actor_variables),
+          trainable_actor_variables, self._actor_optimizer)
+      with tf.control_dependencies([train_op]):
+        return tf.identity(actor_loss)
+
+    def _alpha_update():
+      with tf.GradientTape(watch_accessed_variables=False) as tape:
+        tape.watch(alpha_variable)
+        alpha_loss = self.alpha_loss(time_steps, weights=weights)
+      tf.debugging.check_numerics(alpha_loss, 'Alpha loss is inf or nan.')
+      train_op = self._apply_gradients(
+          tape.gradient(alpha_loss, alpha_variable), alpha_variable,
+          self._alpha_optimizer)
+      with tf.control_dependencies([train_op]):
+        return tf.identity(alpha_loss)
+
+    def _vae_update():
+      vae_variables = (self._z_inference_network.trainable_variables +
+                       self._action_generator.trainable_variables)
+      with tf.GradientTape(watch_accessed_variables=False) as tape:
+        tape.watch(vae_variables)
+        vae_loss = self.vae_loss(time_steps, actions, next_time_steps)
+      tf.debugging.check_numerics(vae_loss, 'VAE loss is inf or nan.')
+      train_op = self._apply_gradients(
+          tape.gradient(vae_loss, vae_variables), vae_variables,
+          self._actor_optimizer)
+      with tf.control_dependencies([train_op]):
+        return tf.identity(vae_loss)
+
+    def _target_update():
+      with tf.control_dependencies([self._update_target()]):
+        return tf.constant(0.0)
+
+    zero = tf.constant(0.0)
+    outputs = []
+    critic_loss, td_errors = self._run_scheduled(
+        'critic', _critic_update,
+        (zero, tf.zeros_like(next_time_steps.reward)), outputs)
+    actor_loss = self._run_scheduled('actor', _actor_update, zero, outputs)
+    alpha_loss = self._run_scheduled('alpha', _alpha_update, zero, outputs)
+    vae_loss = None
+    if not self._finetune:
+      vae_loss = self._run_scheduled(
+          'vae', _vae_update,
+          tf.constant(0.0, dtype=self._action_generator.dtype), outputs)
+    self._run_scheduled('target', _target_update, zero, outputs)
+
+    with tf.control_dependencies(outputs):
+      return self._finish_train(critic_loss, actor_loss, alpha_loss, vae_loss,
+                                td_errors, update_target=False)
+
+  def _run_scheduled(self, name, update_fn, skipped_outputs, previous):
+    """Runs `update_fn` when component `name` is due and times it.
+
+    Args:
+      name: The component, a key of the update schedule.
+      update_fn: Function applying one update and returning its outputs.
+      skipped_outputs: Outputs to return when the component is not due.
+      previous: List of the outputs of the components that ran before; the
+        new outputs are appended to it.
+    Returns:
+      The outputs of the last update, or `skipped_outputs`.
+    """
+    period, repeats = self._update_schedule[name]
+    with tf.name_scope('update_' + name):
+      with tf.control_dependencies(tf.nest.flatten(previous)):
+        start_time = tf.timestamp()
+      with tf.control_dependencies([start_time]):
+        due = tf.equal(self.train_step_counter % period, 0)
+
+      def _run_repeats():
+        outputs = update_fn()
+        for _ in range(repeats - 1):
+          with tf.control_dependencies(tf.nest.flatten(outputs)):
+            outputs = update_fn()
+        return outputs
+
+      outputs = tf.cond(due, _run_repeats, lambda: skipped_outputs)
+      with tf.control_dependencies(tf.nest.flatten(outputs)):
+        elapsed = tf.timestamp() - start_time
+    self._scalar_summary('UpdateTime', name, elapsed)
+    previous.extend(tf.nest.flatten(outputs) + [elapsed])
+    return outputs
+
+  def _finish_train(self, critic_loss, actor_loss, alpha_loss, vae_loss,
+                    td_errors, update_target=True):
+    """Writes loss summaries, steps the counter and updates the targets."""
+    self._scalar_summary('Losses', 'critic_loss', critic_loss)
+    self._scalar_summary('Losses', 'actor_loss', actor_loss)
+    self._scalar_summary('Losses', 'alpha_loss', alpha_loss)
+
+    self.train_step_counter.assign_add(1)
+    if update_target:
+      self._update_target()
+    if vae_loss is not None:
       total_loss = critic_loss + actor_loss + alpha_loss + tf.dtypes.cast(vae_loss, 'float32')
     else:
       total_loss = critic_loss + actor_loss + alpha_loss
 
     extra = SacLossInfo(critic_loss=critic_loss,
                         actor_loss=actor_loss,
-                        alpha_loss=alpha_loss)
+                        alpha_loss=alpha_loss,
+                        td_errors=td_errors)
 
     return tf_agent.LossInfo(loss=total_loss, extra=extra)
 
+  def _scalar_summary(self, scope, name, data):
+    """Writes the scalar `scope/name`, or records it in the aggregator."""
+    if self._summary_aggregator is not None:
+      return self._summary_aggregator.record(scope + '/' + name, data)
+    with tf.name_scope(scope):
+      return tf.compat.v2.summary.scalar(
+          name=name, data=data, step=self.train_step_counter)
+
   def _apply_gradients(self, gradients, variables, optimizer):
     # list(...) is required for Python3.
     grads_and_vars = list(zip(gradients, variables))
@@ -336,7 +668,7 @@ class SacAgent(tf_agent.TFAgent):
       eager_utils.add_gradients_summaries(grads_and_vars,
                                           self.train_step_counter)
 
-    optimizer.apply_gradients(grads_and_vars)
+    return optimizer.apply_gradients(grads_and_vars)
 
   def _get_target_updater(self, tau=1.0, period=1):
     """Performs a soft update of the target network parameters.
@@ -353,17 +685,14 @@ class SacAgent(tf_agent.TFAgent):
 
       def update():
         """Update target network."""
-        critic_update_1 = common.soft_variables_update(
-            self._critic_network_1.variables,
-            self._target_critic_network_1.variables,
-            tau,
-            tau_non_trainable=1.0)
-        critic_update_2 = common.soft_variables_update(
-            self._critic_network_2.variables,
-            self._target_critic_network_2.variables,
-            tau,
-            tau_non_trainable=1.0)
-        return tf.group(critic_update_1, critic_update_2)
+        critic_updates = [
+            common.soft_variables_update(
+                critic.variables,
+                target_critic.variables,
+                tau,
+                tau_non_trainable=1.0)
+            for critic, target_critic in self._critic_and_target_networks()]
+        return tf.group(*critic_updates)
 
       return common.Periodically(update, period, 'update_targets')
 
@@ -404,6 +733,29 @@ class SacAgent(tf_agent.TFAgent):
     Returns:
       critic_loss: A scalar critic loss.
     """
+    critic_loss, _ = self._critic_loss_and_td_errors(
+        time_steps,
+        actions,
+        next_time_steps,
+        td_errors_loss_fn,
+        gamma=gamma,
+        reward_scale_factor=reward_scale_factor,
+        weights=weights)
+    return critic_loss
+
+  def _critic_loss_and_td_errors(self,
+                                 time_steps,
+                                 actions,
+                                 next_time_steps,
+                                 td_errors_loss_fn,
+                                 gamma=1.0,
+                                 reward_scale_factor=1.0,
+                                 weights=None):
+    """Computes the critic loss and the per-element absolute TD errors.
+
+    The TD errors are averaged over all critics and are used as new
+    priorities by prioritized replay. See `critic_loss` for the arguments.
+    """
     with tf.name_scope('critic_loss'):
       tf.nest.assert_same_structure(actions, self.action_spec)
       tf.nest.assert_same_structure(time_steps, self.time_step_spec)
@@ -411,12 +763,10 @@ class SacAgent(tf_agent.TFAgent):
 
       next_actions, next_log_pis = self._actions_and_log_probs(next_time_steps)
       target_input = (next_time_steps.observation, next_actions)
-      target_q_values1, unused_network_state1 = self._target_critic_network_1(
-          target_input, next_time_steps.step_type, training=False)
-      target_q_values2, unused_network_state2 = self._target_critic_network_2(
-          target_input, next_time_steps.step_type, training=False)
+      target_q_values = self._critic_q_values(
+          target_input, next_time_steps.step_type, training=False, target=True)
       target_q_values = (
-          tf.minimum(target_q_values1, target_q_values2) -
+          tf.reduce_min(input_tensor=target_q_values, axis=0) -
           tf.exp(self._log_alpha) * next_log_pis)
 
       td_targets = tf.stop_gradient(
@@ -424,13 +774,14 @@ class SacAgent(tf_agent.TFAgent):
           gamma * next_time_steps.discount * target_q_values)
 
       pred_input = (time_steps.observation, actions)
-      pred_td_targets1, _ = self._critic_network_1(
-          pred_input, time_steps.step_type, training=True)
-      pred_td_targets2, _ = self._critic_network_2(
+      pred_td_targets = self._critic_q_values(
           pred_input, time_steps.step_type, training=True)
-      critic_loss1 = td_errors_loss_fn(td_targets, pred_td_targets1)
-      critic_loss2 = td_errors_loss_fn(td_targets, pred_td_targets2)
-      critic_loss = critic_loss1 + critic_loss2
+      # Sum of the per-critic losses, so that td_errors_loss_fn may reduce.
+      critic_loss = tf.add_n([
+          td_errors_loss_fn(td_targets, pred)
+          for pred in tf.unstack(pred_td_targets)])
+      abs_td_errors = tf.stop_gradient(tf.reduce_mean(
+          input_tensor=tf.abs(td_targets - pred_td_targets), axis=0))
 
       if weights is not None:
         critic_loss *= weights
@@ -444,41 +795,38 @@ class SacAgent(tf_agent.TFAgent):
       critic_loss = tf.reduce_mean(input_tensor=critic_loss)
 
       if self._debug_summaries:
-        td_errors1 = td_targets - pred_td_targets1
-        td_errors2 = td_targets - pred_td_targets2
-        td_errors = tf.concat([td_errors1, td_errors2], axis=0)
+        td_errors = tf.reshape(td_targets - pred_td_targets, [-1])
         common.generate_tensor_summaries('td_errors', td_errors,
                                          self.train_step_counter)
         common.generate_tensor_summaries('td_targets', td_targets,
                                          self.train_step_counter)
-        common.generate_tensor_summaries('pred_td_targets1', pred_td_targets1,
-                                         self.train_step_counter)
-        common.generate_tensor_summaries('pred_td_targets2', pred_td_targets2,
-                                         self.train_step_counter)
+        for i, pred in enumerate(tf.unstack(pred_td_targets)):
+          common.generate_tensor_summaries('pred_td_targets%d' % (i + 1), pred,
+                                           self.train_step_counter)
 
-      return critic_loss
+      return critic_loss, abs_td_errors
 
-  def actor_loss(self, time_steps, weights=None):
+  def actor_loss(self, time_steps, weights=None, actions_and_log_pi=None):
     """Computes the actor_loss for SAC training.
     Args:
       time_steps: A batch of timesteps.
       weights: Optional scalar or elementwise (per-batch-entry) importance
         weights.
+      actions_and_log_pi: Optional `(actions, log_pi)` already sampled for
+        `time_steps`; sampled from the train policy if None.
     Returns:
       actor_loss: A scalar actor loss.
     """
     with tf.name_scope('actor_loss'):
       tf.nest.assert_same_structure(time_steps, self.time_step_spec)
 
-      actions, log_pi = self._actions_and_log_probs(time_steps)
+      if actions_and_log_pi is None:
+        actions_and_log_pi = self._actions_and_log_probs(time_steps)
+      actions, log_pi = actions_and_log_pi
       target_input = (time_steps.observation, actions)
-      target_q_values1, _ = self._critic_network_1(target_input,
-                                                   time_steps.step_type,
-                                                   training=False)
-      target_q_values2, _ = self._critic_network_2(target_input,
-                                                   time_steps.step_type,
-                                                   training=False)
-      target_q_values = tf.minimum(target_q_values1, target_q_values2)
+      target_q_values = self._critic_q_values(
+          target_input, time_steps.step_type, training=False)
+      target_q_values = tf.reduce_min(input_tensor=target_q_values, axis=0)
       actor_loss = tf.exp(self._log_alpha) * log_pi - target_q_values
       if nest_utils.is_batched_nested_tensors(
           time_steps, self.time_step_spec, num_outer_dims=2):
@@ -523,19 +871,23 @@ class SacAgent(tf_agent.TFAgent):
 
       return actor_loss
 
-  def alpha_loss(self, time_steps, weights=None):
+  def alpha_loss(self, time_steps, weights=None, actions_and_log_pi=None):
     """Computes the alpha_loss for EC-SAC training.
     Args:
       time_steps: A batch of timesteps.
       weights: Optional scalar or elementwise (per-batch-entry) importance
         weights.
+      actions_and_log_pi: Optional `(actions, log_pi)` already sampled for
+        `time_steps`; sampled from the train policy if None.
     Returns:
       alpha_loss: A scalar alpha loss.
     """
     with tf.name_scope('alpha_loss'):
       tf.nest.assert_same_structure(time_steps, self.time_step_spec)
 
-      unused_actions, log_pi = self._actions_and_log_probs(time_steps)
+      if actions_and_log_pi is None:
+        actions_and_log_pi = self._actions_and_log_probs(time_steps)
+      unused_actions, log_pi = actions_and_log_pi
       entropy_diff = tf.stop_gradient(-log_pi - self._target_entropy)
       alpha_loss = (self._log_alpha * entropy_diff)
 
@@ -563,69 +915,76 @@ class SacAgent(tf_agent.TFAgent):
       return alpha_loss
   
   def vae_loss(self, time_steps, actions, next_time_steps):
-    
-    def _sample_gaussian_noise(means, stddevs):
-      return means + stddevs * tf.random_normal(
-            tf.shape(stddevs), 0., 1., dtype=tf.float64)
-    
-    def log_normal(x, mean, stddev):
-      stddev = tf.abs(stddev)
-      stddev = tf.add(stddev, EPS) 
-      return -0.5 * tf.reduce_sum((tf.dtypes.cast(tf.log(2 * np.pi), 'float64') + tf.dtypes.cast(tf.log(tf.square(stddev)), 'float64')) + tf.dtypes.cast(tf.square(x-mean), 'float64') / tf.dtypes.cast(tf.square(stddev), 'float64'), axis=-1)
-      
-      '''
-      return -0.5 * tf.reduce_sum(
-        (tf.log(2 * np.pi) + tf.log(tf.square(stddev))
-         + tf.square(x - mean) / tf.square(stddev)),
-         axis=-1)
-      '''
-    def _normal_kld(z, z_mean, z_stddev, weights=1.0):
-      kld_array = (log_normal(z, z_mean, z_stddev) -
-                      log_normal(z, 0.0, 1.0))
-      return tf.losses.compute_weighted_loss(kld_array, weights)  
-    
-    def l2_loss(targets,
-            outputs,
-            weights=1.0,
-            reduction=tf.losses.Reduction.SUM_BY_NONZERO_WEIGHTS):
-      loss = 0.5 * tf.reduce_sum(tf.dtypes.cast(tf.square(tf.dtypes.cast(targets, 'float64') - tf.dtypes.cast(outputs, 'float64')), 'float64'), axis=-1)
-      return tf.losses.compute_weighted_loss(loss, weights, reduction=reduction)    
-    def action_loss(targets, outputs, weights=1.0):
-      assert len(targets.shape) == len(outputs.shape)
-      # Weight starting position by 10.
-      return 10.0 * l2_loss(
-        targets=targets[..., :2],
-        outputs=outputs[..., :2],
-        weights=weights) + l2_loss(
-            targets=targets[..., 2:],
-            outputs=outputs[..., 2:],
-            weights=weights)
+    """Computes the latent action VAE loss.
 
+    The loss is computed in the dtype of the action generator.
+    """
+    del next_time_steps  # unused.
     with tf.name_scope('loss_vae'):
-        
-      z_means, z_stddevs = self._z_inference_network(
-       	(time_steps.observation, actions))
-      zs = _sample_gaussian_noise(z_means, z_stddevs)
-      # Predict
-      pred_actions = self._action_generator(
-	(time_steps.observation, zs))
-
-      # Losses
-      z_kld = _normal_kld(
-	zs,
-	z_means,
-	z_stddevs)
-
-      action_loss = action_loss(
-	    actions,
-	    pred_actions) 
-
-      # Summaries.
-      tf.compat.v2.summary.scalar(
-	name='z_kld', data=z_kld,
-	step=self.train_step_counter)
-      tf.compat.v2.summary.scalar(
-	name='action_loss', data=action_loss,
-	step=self.train_step_counter)
+      z_kld, action_loss = vae_losses(
+          self._z_inference_network, self._action_generator,
+          time_steps.observation, actions)
+
+    # Summaries.
+    self._scalar_summary('loss_vae', 'z_kld', z_kld)
+    self._scalar_summary('loss_vae', 'action_loss', action_loss)
 
     return z_kld + action_loss
+
+
+def _log_normal(x, mean, stddev):
+  mean = tf.convert_to_tensor(mean, dtype=x.dtype)
+  stddev = tf.abs(tf.convert_to_tensor(stddev, dtype=x.dtype)) + EPS
+  return -0.5 * tf.reduce_sum(
+      np.log(2 * np.pi) + tf.log(tf.square(stddev)) +
+      tf.square(x - mean) / tf.square(stddev),
+      axis=-1)
+
+
+def _normal_kld(z, z_mean, z_stddev, weights=1.0):
+  kld_array = _log_normal(z, z_mean, z_stddev) - _log_normal(z, 0.0, 1.0)
+  return tf.losses.compute_weighted_loss(kld_array, weights)
+
+
+def _l2_loss(targets,
+             outputs,
+             weights=1.0,
+             reduction=tf.losses.Reduction.SUM_BY_NONZERO_WEIGHTS):
+  loss = 0.5 * tf.reduce_sum(tf.square(targets - outputs), axis=-1)
+  return tf.losses.compute_weighted_loss(loss, weights, reduction=reduction)
+
+
+def _action_loss(targets, outputs, weights=1.0):
+  assert len(targets.shape) == len(outputs.shape)
+  # Weight starting position by 10.
+  return 10.0 * _l2_loss(
+      targets=targets[..., :2],
+      outputs=outputs[..., :2],
+      weights=weights) + _l2_loss(
+          targets=targets[..., 2:],
+          outputs=outputs[..., 2:],
+          weights=weights)
+
+
+def vae_losses(z_inference_network, action_generator, observations, actions,
+               noise=None):
+  """Returns the (z_kld, action_loss) terms of the latent action VAE.
+
+  Both terms are computed in `action_generator.dtype`.
+
+  Args:
+    z_inference_network: The `ZInferenceNetwork` encoding (obs, action) to z.
+    action_generator: The `ActionGenerator` decoding (obs, z) to an action.
+    observations: A batch of observations.
+    actions: The batch of actions to reconstruct.
+    noise: Optional standard normal sample used to draw z; drawn if None.
+  """
+  dtype = action_generator.dtype
+  z_means, z_stddevs = z_inference_network((observations, actions))
+  if noise is None:
+    noise = tf.random.normal(tf.shape(z_stddevs), dtype=dtype)
+  zs = z_means + z_stddevs * tf.dtypes.cast(noise, dtype)
+  pred_actions = action_generator((observations, zs))
+  z_kld = _normal_kld(zs, z_means, z_stddevs)
+  action_loss = _action_loss(tf.dtypes.cast(actions, dtype), pred_actions)
+  return z_kld, action_loss
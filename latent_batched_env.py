@@ -0,0 +1,118 @@
+"""A batched py environment over `gym_cheetah.envs.BatchedCheetahEnv`.
+
+`BatchedCheetahPyEnvironment` steps K cheetah simulations with one Python call
+per batch instead of K (`BatchedPyEnvironment` or `ParallelPyEnvironment`
+call every env separately). Episodes follow `suite_gym.load` of the matching
+gym id: FIRST on reset, MID steps with discount 1, and a LAST step after
+`max_episode_steps` steps, after which that env is reset on its next step.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import gin
+import numpy as np
+
+import gym_cheetah
+from gym_cheetah import envs as cheetah_envs
+from tf_agents.environments import py_environment
+from tf_agents.specs import array_spec
+from tf_agents.trajectories import time_step as ts
+
+
+def cheetah_env_kwargs(env_name):
+  """Returns the `BatchedCheetahEnv` kwargs matching the gym id `env_name`.
+
+  Raises:
+    ValueError: If `env_name` is not a cheetah running task.
+  """
+  if env_name in ('HalfCheetah-v2', 'Cheetah-v0'):
+    # HalfCheetah-v2 has the same model, observations and forward reward.
+    return dict(direction=1.0, reward_shape='linear')
+  if env_name in gym_cheetah.ALIASES:
+    return dict(gym_cheetah.ALIASES[env_name])
+  raise ValueError('No batched cheetah env for %r.' % env_name)
+
+
+@gin.configurable
+class BatchedCheetahPyEnvironment(py_environment.PyEnvironment):
+  """K cheetahs as one batched `PyEnvironment`.
+
+  The arrays of the returned time steps are reused by the next `step`, as
+  `TFPyEnvironment` copies them into tensors right away.
+  """
+
+  def __init__(self, num_envs, max_episode_steps=1000, seed=None,
+               **env_kwargs):
+    """Creates the simulations.
+
+    Args:
+      num_envs: Number of simulations K, the batch size.
+      max_episode_steps: Steps after which an episode ends.
+      seed: Seed of the reset noise.
+      **env_kwargs: target_velocity, direction, reward_shape and frame_skip of
+        `BatchedCheetahEnv`, e.g. from `cheetah_env_kwargs`.
+    """
+    super(BatchedCheetahPyEnvironment, self).__init__()
+    self._env = cheetah_envs.BatchedCheetahEnv(num_envs, seed=seed,
+                                               **env_kwargs)
+    self._max_episode_steps = max_episode_steps
+    # The specs GymWrapper builds from the gym spaces.
+    self._observation_spec = array_spec.BoundedArraySpec(
+        shape=(self._env.observation_dim,), dtype=np.float64,
+        minimum=-np.inf, maximum=np.inf, name='observation')
+    self._action_spec = array_spec.BoundedArraySpec(
+        shape=(self._env.action_dim,), dtype=np.float32,
+        minimum=self._env.action_low, maximum=self._env.action_high,
+        name='action')
+
+    self._episode_steps = np.zeros(num_envs, dtype=np.int64)
+    self._step_types = np.full(num_envs, ts.StepType.FIRST, dtype=np.int32)
+    self._rewards = np.zeros(num_envs, dtype=np.float32)
+    self._discounts = np.ones(num_envs, dtype=np.float32)
+
+  @property
+  def batched(self):
+    return True
+
+  @property
+  def batch_size(self):
+    return self._env.num_envs
+
+  def observation_spec(self):
+    return self._observation_spec
+
+  def action_spec(self):
+    return self._action_spec
+
+  def _time_step(self, observations):
+    return ts.TimeStep(self._step_types, self._rewards, self._discounts,
+                       observations)
+
+  def _reset(self):
+    observations = self._env.reset()
+    self._episode_steps.fill(0)
+    self._step_types.fill(ts.StepType.FIRST)
+    self._rewards.fill(0)
+    return self._time_step(observations)
+
+  def _step(self, action):
+    # Envs whose episode ended last step are stepped with the others to keep
+    # the pool in lockstep, then reset.
+    done = self._step_types == ts.StepType.LAST
+    observations, rewards, _ = self._env.step(np.asarray(action))
+    self._episode_steps += 1
+    np.copyto(self._rewards, rewards, casting='same_kind')
+    self._step_types.fill(ts.StepType.MID)
+    self._step_types[self._episode_steps >= self._max_episode_steps] = (
+        ts.StepType.LAST)
+    if done.any():
+      observations = self._env.reset(np.flatnonzero(done))
+      self._episode_steps[done] = 0
+      self._step_types[done] = ts.StepType.FIRST
+      self._rewards[done] = 0
+    return self._time_step(observations)
+
+  def seed(self, seed):
+    return self._env.seed(seed)
@@ -0,0 +1,142 @@
+"""Critic ensemble evaluated with batched matmuls.
+
+`EnsembleCriticNetwork` holds N critics with the layout of the tf_agents
+`CriticNetwork` (observation layers, action layers, joint layers, a scalar
+output). Each layer of all N members is stored as one stacked kernel, so the
+whole ensemble costs one batched matmul per layer instead of N small ones.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import gin
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.networks import network
+
+
+@gin.configurable
+class EnsembleCriticNetwork(network.Network):
+  """N Q-networks with stacked [N, ...] weights.
+
+  Calling the network on `(observations, actions)` of batch size B returns
+  Q-values of shape [N, B], one row per member.
+  """
+
+  def __init__(self,
+               input_tensor_spec,
+               num_critics=2,
+               observation_fc_layer_params=None,
+               action_fc_layer_params=None,
+               joint_fc_layer_params=None,
+               activation_fn=tf.nn.relu,
+               name='EnsembleCriticNetwork'):
+    """Creates an instance of `EnsembleCriticNetwork`.
+
+    Args:
+      input_tensor_spec: A tuple of (observation, action) each a nest of
+        `tensor_spec.TensorSpec` representing the inputs.
+      num_critics: Number of ensemble members N.
+      observation_fc_layer_params: Optional list of fully connected layer sizes
+        applied to the observations, as in `CriticNetwork`.
+      action_fc_layer_params: Optional list of fully connected layer sizes
+        applied to the actions.
+      joint_fc_layer_params: Optional list of fully connected layer sizes
+        applied to the concatenated observation and action features.
+      activation_fn: Activation function of the hidden layers.
+      name: A string representing name of the network.
+
+    Raises:
+      ValueError: If `observation_spec` or `action_spec` contains more than one
+        item, or if `num_critics` is smaller than 1.
+    """
+    super(EnsembleCriticNetwork, self).__init__(
+        input_tensor_spec=input_tensor_spec, state_spec=(), name=name)
+
+    observation_spec, action_spec = input_tensor_spec
+    if len(tf.nest.flatten(observation_spec)) > 1:
+      raise ValueError('Only a single observation is supported by this network')
+    if len(tf.nest.flatten(action_spec)) > 1:
+      raise ValueError('Only a single action is supported by this network')
+    if num_critics < 1:
+      raise ValueError('num_critics must be at least 1, got %d' % num_critics)
+
+    self._num_critics = num_critics
+    self._activation_fn = activation_fn
+
+    observation_dim = _num_elements(tf.nest.flatten(observation_spec)[0])
+    action_dim = _num_elements(tf.nest.flatten(action_spec)[0])
+    self._observation_layers, observation_dim = self._create_layers(
+        'observation', observation_dim, observation_fc_layer_params)
+    self._action_layers, action_dim = self._create_layers(
+        'action', action_dim, action_fc_layer_params)
+    self._joint_layers, joint_dim = self._create_layers(
+        'joint', observation_dim + action_dim, joint_fc_layer_params)
+    # Same small uniform output init as `CriticNetwork`.
+    self._value_layer = self._create_layer(
+        'value', joint_dim, 1,
+        tf.compat.v1.initializers.random_uniform(minval=-0.003, maxval=0.003))
+
+  @property
+  def num_critics(self):
+    return self._num_critics
+
+  def _create_layer(self, name, input_dim, output_dim, kernel_initializer):
+    kernel = self.add_weight(
+        name='%s/kernel' % name,
+        shape=[self._num_critics, input_dim, output_dim],
+        initializer=kernel_initializer,
+        trainable=True)
+    bias = self.add_weight(
+        name='%s/bias' % name,
+        shape=[self._num_critics, 1, output_dim],
+        initializer=tf.compat.v1.initializers.zeros(),
+        trainable=True)
+    return kernel, bias
+
+  def _create_layers(self, name, input_dim, layer_params):
+    """Creates stacked dense layers; returns them and the output size."""
+    layers = []
+    for i, num_units in enumerate(layer_params or ()):
+      # VarianceScaling(scale=1/3, mode='fan_in', distribution='uniform') per
+      # member, matching the hidden layers of `CriticNetwork`.
+      limit = np.sqrt(1. / input_dim)
+      layers.append(self._create_layer(
+          '%s_%d' % (name, i), input_dim, num_units,
+          tf.compat.v1.initializers.random_uniform(
+              minval=-limit, maxval=limit)))
+      input_dim = num_units
+    return layers, input_dim
+
+  def _apply_layers(self, layers, inputs):
+    for kernel, bias in layers:
+      inputs = self._activation_fn(tf.matmul(inputs, kernel) + bias)
+    return inputs
+
+  def call(self, inputs, step_type=(), network_state=()):
+    del step_type  # unused.
+    observations, actions = inputs
+    observations = tf.cast(tf.nest.flatten(observations)[0], tf.float32)
+    actions = tf.cast(tf.nest.flatten(actions)[0], tf.float32)
+    observations = tf.compat.v1.layers.flatten(observations)
+    actions = tf.compat.v1.layers.flatten(actions)
+
+    # [B, D] -> [N, B, D] so every layer is one batched matmul.
+    multiples = [self._num_critics, 1, 1]
+    observations = tf.tile(tf.expand_dims(observations, 0), multiples)
+    actions = tf.tile(tf.expand_dims(actions, 0), multiples)
+
+    observations = self._apply_layers(self._observation_layers, observations)
+    actions = self._apply_layers(self._action_layers, actions)
+    joint = tf.concat([observations, actions], axis=-1)
+    joint = self._apply_layers(self._joint_layers, joint)
+
+    kernel, bias = self._value_layer
+    q_values = tf.matmul(joint, kernel) + bias
+    return tf.squeeze(q_values, axis=-1), network_state
+
+
+def _num_elements(spec):
+  return int(np.prod(spec.shape.as_list()))
@@ -0,0 +1,163 @@
+"""Checks that float32 latent networks reproduce the float64 VAE losses.
+
+Builds the `ZInferenceNetwork`/`ActionGenerator` pair once in float64 and once
+in float32 with the same weights and compares, on the same batches and noise,
+  * the loss of the original float64 `vae_loss` implementation,
+  * `latent_agent.vae_losses` in float64,
+  * `latent_agent.vae_losses` in float32,
+  * the decoded actions of both generators.
+Observations are also scaled up to check that the float32 path stays finite.
+To run:
+```bash
+python latent_dtype_parity.py --num_batches=20 --rtol=1e-4
+```
+Exits with a non-zero status if any value is non-finite or off by more than
+`rtol`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+
+from absl import app
+from absl import flags
+
+import numpy as np
+import tensorflow as tf
+
+import latent_action_generator
+import latent_agent
+import latent_inference_network
+from tf_agents.specs import tensor_spec
+
+flags.DEFINE_integer('num_batches', 20, 'Random batches per observation scale.')
+flags.DEFINE_integer('batch_size', 256, 'Batch size of every check.')
+flags.DEFINE_integer('observation_dim', 17, 'HalfCheetah observation size.')
+flags.DEFINE_integer('action_dim', 6, 'HalfCheetah action size.')
+flags.DEFINE_multi_float('observation_scale', [1.0, 10.0, 100.0],
+                         'Multipliers applied to the random observations.')
+flags.DEFINE_float('rtol', 1e-4, 'Largest accepted relative error.')
+flags.DEFINE_integer('seed', 0, 'Seed of the weights and batches.')
+
+FLAGS = flags.FLAGS
+
+
+def legacy_vae_losses(z_inference_network, action_generator, observations,
+                      actions, noise):
+  """The float64 VAE loss as `SacAgent.vae_loss` computed it originally."""
+
+  def log_normal(x, mean, stddev):
+    stddev = tf.abs(stddev)
+    stddev = tf.add(stddev, latent_agent.EPS)
+    return -0.5 * tf.reduce_sum((tf.dtypes.cast(tf.log(2 * np.pi), 'float64') + tf.dtypes.cast(tf.log(tf.square(stddev)), 'float64')) + tf.dtypes.cast(tf.square(x-mean), 'float64') / tf.dtypes.cast(tf.square(stddev), 'float64'), axis=-1)
+
+  def l2_loss(targets, outputs):
+    loss = 0.5 * tf.reduce_sum(tf.dtypes.cast(tf.square(tf.dtypes.cast(targets, 'float64') - tf.dtypes.cast(outputs, 'float64')), 'float64'), axis=-1)
+    return tf.losses.compute_weighted_loss(loss)
+
+  z_means, z_stddevs = z_inference_network((observations, actions))
+  zs = z_means + z_stddevs * noise
+  pred_actions = action_generator((observations, zs))
+  z_kld = tf.losses.compute_weighted_loss(
+      log_normal(zs, z_means, z_stddevs) - log_normal(zs, 0.0, 1.0))
+  action_loss = 10.0 * l2_loss(actions[..., :2], pred_actions[..., :2]) + (
+      l2_loss(actions[..., 2:], pred_actions[..., 2:]))
+  return z_kld, action_loss
+
+
+def _build_networks(observation_spec, action_spec, dtype, suffix):
+  z_spec = tensor_spec.TensorSpec(
+      shape=[latent_action_generator.DIM_Z], dtype=dtype, name='z')
+  action_generator = latent_action_generator.ActionGenerator(
+      input_tensor_spec=(observation_spec, z_spec), dtype=dtype,
+      name='ActionGenerator' + suffix)
+  action_generator.create_variables()
+  z_inference_network = latent_inference_network.ZInferenceNetwork(
+      input_tensor_spec=(observation_spec, action_spec), dtype=dtype,
+      name='ZInferenceNetwork' + suffix)
+  z_inference_network.create_variables()
+  return z_inference_network, action_generator
+
+
+def _relative_error(value, reference):
+  return np.max(np.abs(value - reference) / np.maximum(np.abs(reference), 1.0))
+
+
+def main(_):
+  tf.compat.v1.set_random_seed(FLAGS.seed)
+  rng = np.random.RandomState(FLAGS.seed)
+  observation_spec = tensor_spec.TensorSpec(
+      [FLAGS.observation_dim], tf.float64, 'observation')
+  action_spec = tensor_spec.BoundedTensorSpec(
+      [FLAGS.action_dim], tf.float32, -1.0, 1.0, 'action')
+
+  inference_64, generator_64 = _build_networks(
+      observation_spec, action_spec, tf.float64, '64')
+  inference_32, generator_32 = _build_networks(
+      observation_spec, action_spec, tf.float32, '32')
+  copy_op = tf.group(*[
+      v32.assign(tf.dtypes.cast(v64, tf.float32)) for v32, v64 in zip(
+          generator_32.variables + inference_32.variables,
+          generator_64.variables + inference_64.variables)])
+
+  observations = tf.compat.v1.placeholder(
+      tf.float64, [None, FLAGS.observation_dim])
+  actions = tf.compat.v1.placeholder(tf.float32, [None, FLAGS.action_dim])
+  noise = tf.compat.v1.placeholder(
+      tf.float64, [None, latent_action_generator.DIM_Z])
+  zs = tf.compat.v1.placeholder(
+      tf.float64, [None, latent_action_generator.DIM_Z])
+  checks = {
+      'legacy_float64': legacy_vae_losses(
+          inference_64, generator_64, observations, actions, noise),
+      'float64': latent_agent.vae_losses(
+          inference_64, generator_64, observations, actions, noise),
+      'float32': latent_agent.vae_losses(
+          inference_32, generator_32, observations, actions, noise),
+      'decoded_float64': generator_64((observations, zs)),
+      'decoded_float32': generator_32((observations, zs)),
+  }
+
+  failures = 0
+  with tf.compat.v1.Session() as sess:
+    sess.run(tf.compat.v1.global_variables_initializer())
+    sess.run(copy_op)
+    for scale in FLAGS.observation_scale:
+      errors = {'float64': 0.0, 'float32': 0.0, 'decoded_float32': 0.0}
+      finite = True
+      for _ in range(FLAGS.num_batches):
+        feed_dict = {
+            observations: scale * rng.standard_normal(
+                [FLAGS.batch_size, FLAGS.observation_dim]),
+            actions: rng.uniform(
+                -1.0, 1.0, [FLAGS.batch_size, FLAGS.action_dim]),
+            noise: rng.standard_normal(
+                [FLAGS.batch_size, latent_action_generator.DIM_Z]),
+            zs: rng.standard_normal(
+                [FLAGS.batch_size, latent_action_generator.DIM_Z]),
+        }
+        values = sess.run(checks, feed_dict=feed_dict)
+        reference = np.array(values['legacy_float64'])
+        for name in ('float64', 'float32'):
+          value = np.array(values[name], dtype=np.float64)
+          finite &= bool(np.all(np.isfinite(value)))
+          errors[name] = max(errors[name], _relative_error(value, reference))
+        decoded = values['decoded_float32'].astype(np.float64)
+        finite &= bool(np.all(np.isfinite(decoded)))
+        errors['decoded_float32'] = max(
+            errors['decoded_float32'],
+            _relative_error(decoded, values['decoded_float64']))
+
+      ok = finite and all(error <= FLAGS.rtol for error in errors.values())
+      failures += not ok
+      print('observation scale {:g}: {} finite={} {}'.format(
+          scale, 'OK' if ok else 'FAIL', finite, ' '.join(
+              '{}={:.2e}'.format(name, error)
+              for name, error in sorted(errors.items()))))
+  sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+  app.run(main)
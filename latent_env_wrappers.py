@@ -0,0 +1,147 @@
+"""Py environment wrappers for the latent SAC experiments.
+
+`ControlDecimation` lets the policy act once every M env steps: each action is
+held (or ramped to from the previous one) for M steps of the wrapped env and
+the M transitions are returned as one, so policy inference and replay writes
+happen M times less often. Use it through `train_eval.env_load_fn`, e.g.
+```
+train_eval.env_load_fn = @latent_env_wrappers.load_decimated
+load_decimated.decimation = 4
+```
+Evaluation should use `undiscounted_eval_env_load_fn(env_load_fn)`, so that
+the eval returns stay plain sums of env rewards.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import functools
+
+import gin
+import numpy as np
+
+from tf_agents.environments import suite_gym
+from tf_agents.environments import wrappers
+
+DECIMATION_MODES = ('hold', 'interpolate')
+
+
+class ControlDecimation(wrappers.PyEnvironmentBaseWrapper):
+  """Applies every action for `decimation` steps of the wrapped env.
+
+  In 'hold' mode the action is repeated; in 'interpolate' mode the applied
+  action moves linearly from the previous action to the new one, reaching it
+  on the last of the steps. The returned reward aggregates the rewards of the
+  steps and the returned discount their discounts, so that the agent's
+  `gamma` applied once per decimated transition matches the env steps:
+    * gamma=None: the sum of the rewards and the product of the discounts
+      (as `wrappers.ActionRepeat`),
+    * gamma set: sum_k gamma^k d_0 ... d_{k-1} r_k and
+      gamma^(n-1) d_0 ... d_{n-1} over the n steps taken.
+  The steps stop early at the end of an episode.
+  """
+
+  def __init__(self, env, decimation, mode='hold', gamma=None):
+    """Creates the wrapper.
+
+    Args:
+      env: An unbatched `PyEnvironment`.
+      decimation: Env steps per action M.
+      mode: 'hold' or 'interpolate'.
+      gamma: Optional discount of the agent, to aggregate the rewards of the
+        M steps as a discounted return.
+
+    Raises:
+      ValueError: If `decimation` < 1, `mode` is unknown or `env` is batched.
+    """
+    super(ControlDecimation, self).__init__(env)
+    if decimation < 1:
+      raise ValueError('decimation must be at least 1, got %d.' % decimation)
+    if mode not in DECIMATION_MODES:
+      raise ValueError('Unknown decimation mode %r; expected one of %s.' %
+                       (mode, ', '.join(DECIMATION_MODES)))
+    if env.batched:
+      raise ValueError('ControlDecimation needs an unbatched env.')
+    self._decimation = decimation
+    self._mode = mode
+    self._gamma = gamma
+    self._previous_action = None
+
+  def _reset(self):
+    self._previous_action = None
+    return self._env.reset()
+
+  def _step(self, action):
+    action = np.asarray(action)
+    start_action = action
+    if self._mode == 'interpolate' and self._previous_action is not None:
+      start_action = self._previous_action
+
+    total_reward = 0.0
+    weight = 1.0
+    discount = 1.0
+    for k in range(self._decimation):
+      step_action = action
+      if start_action is not action:
+        fraction = (k + 1.0) / self._decimation
+        step_action = (start_action + fraction * (action - start_action)).astype(
+            action.dtype)
+      time_step = self._env.step(step_action)
+      if time_step.is_first():
+        # The wrapped env was reset instead of stepped; the action did not
+        # act on the previous episode.
+        self._previous_action = None
+        return time_step
+      if k > 0 and self._gamma is not None:
+        discount *= self._gamma
+      total_reward += weight * time_step.reward
+      discount *= time_step.discount
+      if self._gamma is not None:
+        weight *= self._gamma * time_step.discount
+      if time_step.is_last():
+        break
+
+    self._previous_action = action
+    return time_step._replace(
+        reward=np.asarray(total_reward, dtype=time_step.reward.dtype),
+        discount=np.asarray(discount, dtype=time_step.discount.dtype))
+
+
+@gin.configurable
+def load_decimated(env_name,
+                   decimation=2,
+                   mode='hold',
+                   gamma=None,
+                   env_load_fn=suite_gym.load):
+  """An `env_load_fn` returning `env_load_fn(env_name)` under decimation.
+
+  Args:
+    env_name: Name of the env to load.
+    decimation: Env steps per policy action.
+    mode: 'hold' or 'interpolate', see `ControlDecimation`.
+    gamma: Optional agent discount for discounted reward aggregation.
+    env_load_fn: Loader of the undecimated env; its time limit still counts
+      env steps.
+  """
+  return ControlDecimation(env_load_fn(env_name), decimation, mode=mode,
+                           gamma=gamma)
+
+
+def is_decimated(env_load_fn):
+  """Whether `env_load_fn` is `load_decimated`, possibly as a gin reference."""
+  return env_load_fn is load_decimated or (
+      getattr(env_load_fn, '__name__', None) == load_decimated.__name__ and
+      getattr(env_load_fn, '__module__', None) == __name__)
+
+
+def undiscounted_eval_env_load_fn(env_load_fn):
+  """Returns the loader for eval envs matching the train `env_load_fn`.
+
+  With `load_decimated`, the eval envs keep the decimation (the policy was
+  trained to act every M steps) but drop `gamma`, so an episode's summed
+  rewards are its env return.
+  """
+  if is_decimated(env_load_fn):
+    return functools.partial(load_decimated, gamma=None)
+  return env_load_fn
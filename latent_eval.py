@@ -0,0 +1,282 @@
+"""Batched greedy-policy evaluation for the latent SAC agent.
+
+`BatchedEvaluator` runs eval episodes inside the training process.
+`start_checkpoint_evaluator` moves evaluation into a separate, lower priority
+process that follows the policy checkpoints written by `train_eval`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import multiprocessing
+import os
+import time
+
+from six.moves import queue
+
+import gin
+import numpy as np
+import tensorflow as tf
+
+from absl import logging
+
+import latent_actor_policy
+from tf_agents.environments import batched_py_environment
+from tf_agents.eval import metric_utils
+from tf_agents.metrics import py_metric
+from tf_agents.metrics import py_metrics
+from tf_agents.policies import greedy_policy
+from tf_agents.specs import tensor_spec
+
+
+class BatchedEvaluator(object):
+  """Runs eval episodes on a batch of envs with one policy call per step.
+
+  All envs are reset together and the policy is queried on the full
+  [batch_size, ...] observation batch. An env stops contributing once its
+  first episode ends, and rounds are repeated until `num_episodes` returns
+  have been gathered. The returns and lengths are written into the regular
+  `AverageReturnMetric`/`AverageEpisodeLengthMetric` py metrics, so the eval
+  summaries are unchanged.
+  """
+
+  def __init__(self, environment, policy, metrics):
+    """Builds the batched action op.
+
+    Args:
+      environment: A batched `PyEnvironment`.
+      policy: A `TFPolicy` to evaluate, e.g. a `GreedyPolicy`.
+      metrics: A list of py metrics that are reset and filled on every call.
+    """
+    self._env = environment
+    self._metrics = metrics
+    self._time_step_ph = tensor_spec.to_nest_placeholder(
+        policy.time_step_spec, outer_dims=[environment.batch_size])
+    self._action_op = policy.action(self._time_step_ph).action
+
+  def _run_round(self, sess):
+    """Runs one episode per env and returns their (returns, lengths)."""
+    batch_size = self._env.batch_size
+    episode_returns = np.zeros(batch_size, dtype=np.float64)
+    episode_lengths = np.zeros(batch_size, dtype=np.int64)
+    active = np.ones(batch_size, dtype=np.bool_)
+    time_step_phs = tf.nest.flatten(self._time_step_ph)
+
+    time_step = self._env.reset()
+    while active.any():
+      action = sess.run(
+          self._action_op,
+          feed_dict=dict(zip(time_step_phs, tf.nest.flatten(time_step))))
+      time_step = self._env.step(action)
+      episode_returns += np.where(active, time_step.reward, 0.0)
+      episode_lengths += active
+      active &= ~time_step.is_last()
+    return episode_returns, episode_lengths
+
+  def compute(self, sess, num_episodes):
+    """Fills the metrics from `num_episodes` episodes and returns results."""
+    returns, lengths = [], []
+    while len(returns) < num_episodes:
+      round_returns, round_lengths = self._run_round(sess)
+      returns.extend(round_returns)
+      lengths.extend(round_lengths)
+
+    for metric in self._metrics:
+      metric.reset()
+      if isinstance(metric, py_metrics.AverageReturnMetric):
+        metric.add_to_buffer(returns[:num_episodes])
+      elif isinstance(metric, py_metrics.AverageEpisodeLengthMetric):
+        metric.add_to_buffer(lengths[:num_episodes])
+    return collections.OrderedDict(
+        (metric.name, metric.result()) for metric in self._metrics)
+
+  def compute_summaries(self,
+                        sess,
+                        num_episodes,
+                        global_step=None,
+                        callback=None,
+                        log=False):
+    """Batched counterpart of `metric_utils.compute_summaries`."""
+    results = self.compute(sess, num_episodes)
+    py_metric.run_summaries(self._metrics)
+    if log:
+      metric_utils.log_metrics(
+          self._metrics, prefix='Step = {}'.format(global_step))
+    if callback is not None:
+      callback(results, global_step)
+    return results
+
+
+def _append_results(results_path, global_step, results):
+  """Appends one row per evaluated checkpoint to a CSV results table."""
+  write_header = not tf.io.gfile.exists(results_path)
+  with tf.io.gfile.GFile(results_path, 'a') as f:
+    if write_header:
+      f.write(','.join(['step'] + list(results.keys())) + '\n')
+    f.write(','.join([str(global_step)] +
+                     ['{:.6f}'.format(float(v)) for v in results.values()]))
+    f.write('\n')
+
+
+def _checkpoint_evaluator_main(root_dir, env_load_fn, env_name,
+                               actor_network_fn, gin_config, stop_event,
+                               results_queue, num_eval_episodes, num_eval_envs,
+                               nice_increment, num_threads, poll_secs):
+  """Evaluates every new policy checkpoint under `root_dir`/train/policy."""
+  gin.parse_config(gin_config)
+  tf.compat.v1.enable_resource_variables()
+  if nice_increment:
+    os.nice(nice_increment)
+  policy_dir = os.path.join(root_dir, 'train', 'policy')
+  eval_dir = os.path.join(root_dir, 'eval')
+  results_path = os.path.join(eval_dir, 'results.csv')
+
+  eval_py_env = batched_py_environment.BatchedPyEnvironment(
+      [env_load_fn(env_name) for _ in range(num_eval_envs)])
+  time_step_spec = tensor_spec.from_spec(eval_py_env.time_step_spec())
+  action_spec = tensor_spec.from_spec(eval_py_env.action_spec())
+  actor_net, unused_action_generator = actor_network_fn(
+      time_step_spec.observation, action_spec)
+  policy = latent_actor_policy.ActorPolicy(
+      time_step_spec=time_step_spec,
+      action_spec=action_spec,
+      actor_network=actor_net,
+      training=False)
+  global_step = tf.compat.v1.train.get_or_create_global_step()
+  # Same object structure as the policy_checkpointer in train_eval.
+  checkpoint = tf.train.Checkpoint(policy=policy, global_step=global_step)
+
+  eval_summary_writer = tf.compat.v2.summary.create_file_writer(eval_dir)
+  eval_metrics = [
+      py_metrics.AverageReturnMetric(buffer_size=num_eval_episodes),
+      py_metrics.AverageEpisodeLengthMetric(buffer_size=num_eval_episodes),
+  ]
+  with eval_summary_writer.as_default(), \
+       tf.compat.v2.summary.record_if(True):
+    for eval_metric in eval_metrics:
+      eval_metric.tf_summaries(train_step=global_step)
+  eval_summary_flush_op = eval_summary_writer.flush()
+  evaluator = BatchedEvaluator(
+      eval_py_env, greedy_policy.GreedyPolicy(policy), eval_metrics)
+
+  config = tf.compat.v1.ConfigProto(
+      intra_op_parallelism_threads=num_threads,
+      inter_op_parallelism_threads=num_threads)
+  with tf.compat.v1.Session(config=config) as sess:
+    sess.run(tf.compat.v1.global_variables_initializer())
+    sess.run(eval_summary_writer.init())
+    last_evaluated = None
+    while True:
+      stopping = stop_event.is_set()
+      # Always jump to the newest checkpoint; any that were written while
+      # the previous one was being evaluated are skipped.
+      latest = tf.train.latest_checkpoint(policy_dir)
+      if latest is not None and latest != last_evaluated:
+        checkpoint.restore(latest).run_restore_ops(sess)
+        if not sess.graph.finalized:
+          # The checkpoint keeps the restore ops of its first restore and
+          # feeds later paths to them; finalizing makes sure that nothing
+          # adds ops to the graph for each new checkpoint.
+          sess.graph.finalize()
+        global_step_val = sess.run(global_step)
+        results = evaluator.compute_summaries(
+            sess,
+            num_episodes=num_eval_episodes,
+            global_step=global_step_val,
+            log=True)
+        sess.run(eval_summary_flush_op)
+        _append_results(results_path, global_step_val, results)
+        results_queue.put((int(global_step_val), dict(results)))
+        last_evaluated = latest
+      elif stopping:
+        break
+      else:
+        time.sleep(poll_secs)
+  eval_py_env.close()
+
+
+@gin.configurable
+def start_checkpoint_evaluator(root_dir,
+                               env_load_fn,
+                               env_name,
+                               actor_network_fn,
+                               num_eval_episodes=30,
+                               num_eval_envs=None,
+                               nice_increment=10,
+                               num_threads=1,
+                               poll_secs=10):
+  """Launches a process that evaluates each new policy checkpoint.
+
+  Results go to the `eval` summary dir and to `eval/results.csv`, and are
+  sent back as `(global_step, results)` pairs through the returned queue; read
+  them with `drain_results`.
+
+  Args:
+    root_dir: The `train_eval` root dir to watch.
+    env_load_fn: Picklable function that creates the eval py environment.
+    env_name: Name passed to `env_load_fn`.
+    actor_network_fn: Picklable function
+      `actor_network_fn(observation_spec, action_spec)` returning the
+      `(actor_network, action_generator)` pair to restore into.
+    num_eval_episodes: Episodes per evaluated checkpoint.
+    num_eval_envs: Envs stepped together; defaults to `num_eval_episodes`.
+    nice_increment: Added to the evaluator's niceness to lower its priority.
+    num_threads: TF intra/inter-op threads for the evaluator session.
+    poll_secs: Seconds between checks for a new checkpoint.
+
+  Returns:
+    A `(process, stop_event, results_queue)` tuple. Setting the event makes
+    the evaluator finish the newest checkpoint and exit; see
+    `stop_checkpoint_evaluator`.
+  """
+  ctx = multiprocessing.get_context('spawn')
+  stop_event = ctx.Event()
+  results_queue = ctx.Queue()
+  process = ctx.Process(
+      target=_checkpoint_evaluator_main,
+      args=(os.path.expanduser(root_dir), env_load_fn, env_name,
+            actor_network_fn, gin.config_str(), stop_event, results_queue,
+            num_eval_episodes, num_eval_envs or num_eval_episodes,
+            nice_increment, num_threads, poll_secs))
+  process.daemon = True
+  process.start()
+  logging.info('Started background checkpoint evaluator.')
+  return process, stop_event, results_queue
+
+
+def drain_results(results_queue):
+  """Returns the `(global_step, results)` pairs received so far."""
+  received = []
+  while True:
+    try:
+      received.append(results_queue.get_nowait())
+    except queue.Empty:
+      return received
+
+
+def stop_checkpoint_evaluator(process, stop_event, results_queue,
+                              timeout_secs=600):
+  """Lets the evaluator finish the newest checkpoint, then stops it.
+
+  The process is terminated if it is still running after `timeout_secs`.
+
+  Returns:
+    The `(global_step, results)` pairs received while waiting.
+  """
+  stop_event.set()
+  received = []
+  deadline = time.time() + timeout_secs
+  # The queue must be drained while waiting: a process does not exit until
+  # the items it put are consumed.
+  while process.is_alive() and time.time() < deadline:
+    received.extend(drain_results(results_queue))
+    process.join(timeout=1)
+  received.extend(drain_results(results_queue))
+  if process.is_alive():
+    logging.warning('Checkpoint evaluator did not exit within %d secs; '
+                    'terminating it.', timeout_secs)
+    process.terminate()
+    process.join()
+  return received
@@ -19,7 +19,16 @@ class ZInferenceNetwork(latent_network_robovat.Network):
 
     def __init__(self,
                  input_tensor_spec,
+                 dtype=tf.float32,
                  name='ZInferenceNetwork'):
+        """Creates the inference network.
+
+        Args:
+            input_tensor_spec: A tuple of (observation, action) specs.
+            dtype: The dtype the network computes in. Inputs are cast to it
+                and the variables are created with it.
+            name: A string representing the name of the network.
+        """
         super(ZInferenceNetwork, self).__init__(
             input_tensor_spec=input_tensor_spec,
             state_spec=(),
@@ -28,11 +37,16 @@ class ZInferenceNetwork(latent_network_robovat.Network):
         self._dim_z = DIM_Z
         self._dim_fc_z = DIM_FC_Z
         self._dim_fc_action = DIM_FC_ACTION
+        self._dtype = tf.as_dtype(dtype)
+
+    @property
+    def dtype(self):
+        return self._dtype
 
     def call(self, input_tensor, step_type=None, network_state=()):
         del step_type    # unused.
-        observations = input_tensor[0]
-        actions = tf.dtypes.cast(input_tensor[1], dtype='float64')
+        observations = tf.dtypes.cast(input_tensor[0], dtype=self._dtype)
+        actions = tf.dtypes.cast(input_tensor[1], dtype=self._dtype)
         inputs = tf.concat([observations, actions], axis=-1)
         with slim.arg_scope(
                 [slim.fully_connected],
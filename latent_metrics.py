@@ -0,0 +1,84 @@
+"""Scalar metrics aggregated in graph variables between summary writes.
+
+`ScalarAggregator.record` folds a scalar into a running [sum, count, min, max]
+variable with a single assign, so recording every train step costs no summary
+ops. `ScalarAggregator.flush` writes the mean, min and max of each metric over
+the window since the last flush and starts a new window; run it every
+`summary_interval` steps.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+
+import numpy as np
+import tensorflow as tf
+
+
+def _empty_window():
+  return tf.constant([0.0, 0.0, np.inf, -np.inf], dtype=tf.float32)
+
+
+class ScalarAggregator(tf.Module):
+  """Running sum, count, min and max of named scalars."""
+
+  def __init__(self, name='ScalarAggregator'):
+    super(ScalarAggregator, self).__init__(name=name)
+    # One [sum, count, min, max] variable per metric, by summary tag.
+    self._windows = collections.OrderedDict()
+
+  def _window(self, tag):
+    if tag not in self._windows:
+      with tf.init_scope(), tf.name_scope(self.name):
+        self._windows[tag] = tf.Variable(
+            _empty_window(), trainable=False,
+            name=tag.replace('/', '_'))
+    return self._windows[tag]
+
+  def record(self, tag, value):
+    """Adds `value` to the current window of `tag`.
+
+    Args:
+      tag: Summary tag the aggregates are written under.
+      value: A scalar tensor; non-scalars are averaged first.
+    Returns:
+      The update op.
+    """
+    window = self._window(tag)
+    value = tf.reduce_mean(tf.dtypes.cast(value, tf.float32))
+    return window.assign(tf.stack([
+        window[0] + value,
+        window[1] + 1.0,
+        tf.minimum(window[2], value),
+        tf.maximum(window[3], value)]))
+
+  def flush(self, step):
+    """Writes `<tag>/mean`, `<tag>/min` and `<tag>/max` and resets the windows.
+
+    Build it under the summary writer it should write to, after every
+    `record` call it should cover. Metrics without any record in the window
+    are not written.
+
+    Args:
+      step: The step the summaries are written at.
+    Returns:
+      An op writing the summaries and then resetting the windows.
+    """
+    write_ops = []
+    for tag, window in self._windows.items():
+      total, count, minimum, maximum = tf.unstack(window.read_value())
+      with tf.compat.v2.summary.record_if(count > 0):
+        write_ops.extend([
+            tf.compat.v2.summary.scalar(
+                name=tag + '/mean', data=total / tf.maximum(count, 1.0),
+                step=step),
+            tf.compat.v2.summary.scalar(
+                name=tag + '/min', data=minimum, step=step),
+            tf.compat.v2.summary.scalar(
+                name=tag + '/max', data=maximum, step=step),
+        ])
+    with tf.control_dependencies(write_ops):
+      return tf.group(*[window.assign(_empty_window())
+                        for window in self._windows.values()])
@@ -105,6 +105,7 @@ class Network(object):
         self._output_tensor_spec = None
         self._state_spec = state_spec
         self._mask_split_fn = mask_split_fn
+        self._checkpointable = None
 
         self._built = False
 
@@ -195,6 +196,19 @@ class Network(object):
         assert self.built
         return self.trainable_weights
 
+    @property
+    def checkpointable(self):
+        """A trackable object holding the variables of this network.
+
+        Variables created through slim are invisible to object-based
+        checkpoints. Assign this to an attribute of a tracked object (a keras
+        network, a policy or an agent) to have them saved and restored.
+        """
+        if self._checkpointable is None:
+            self._checkpointable = tf.Module(name=self._name)
+            self._checkpointable.weights = list(self.variables)
+        return self._checkpointable
+
     @property
     def info_spec(self):
         return ()
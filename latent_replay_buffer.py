@@ -0,0 +1,920 @@
+"""Compact NumPy-backed replay buffer for the latent SAC agent.
+
+`NumpyReplayBuffer` keeps each flattened field of the trajectory spec in one
+preallocated [batch_size, max_length, ...] array, optionally memory-mapped
+from files under a storage directory. Step types are stored as uint8 and
+floating point fields as float32 (or float16), and `add_batch`/`as_dataset`
+mirror the `TFUniformReplayBuffer` surface used by `latent.py`.
+
+`save_snapshot` writes a buffer as a `ReplaySnapshot`, which several
+processes can memory-map read-only and sample from through
+`SnapshotOverlayReplayBuffer` while keeping their new transitions private.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+import gin
+import numpy as np
+import six
+import tensorflow as tf
+
+from absl import logging
+
+from tf_agents.replay_buffers import tf_uniform_replay_buffer
+from tf_agents.trajectories import time_step as ts
+
+_METADATA_FILE = 'metadata.json'
+_PRIORITIES_FILE = 'priorities.npz'
+
+PrioritizedBufferInfo = collections.namedtuple(
+    'PrioritizedBufferInfo', ('ids', 'probabilities', 'weights'))
+_STEP_TYPE_FIELDS = ('step_type', 'next_step_type')
+
+
+def _storage_dtypes(data_spec, float_dtype):
+  """Returns the flat storage dtypes: uint8 step types, `float_dtype` floats."""
+  def _field_dtypes(field):
+    def _dtype(spec):
+      if field in _STEP_TYPE_FIELDS:
+        return np.uint8
+      if spec.dtype.is_floating:
+        return float_dtype
+      return spec.dtype.as_numpy_dtype
+    return tf.nest.map_structure(_dtype, getattr(data_spec, field))
+
+  return tf.nest.flatten(data_spec._replace(
+      **{field: _field_dtypes(field) for field in data_spec._fields}))
+
+
+def _draw_windows(step_types, first, last, sample_batch_size,
+                  skip_boundaries=False):
+  """Draws uniform (rows, ids) of windows starting at ids in [first, last].
+
+  Args:
+    step_types: The [rows, max_length] step type column.
+    first: Smallest id a window may start at.
+    last: Largest id a window may start at.
+    sample_batch_size: Number of windows to draw.
+    skip_boundaries: Redraw windows that start on a LAST step.
+  """
+  if not sample_batch_size:
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+  num_rows, max_length = step_types.shape[:2]
+  rows = np.random.randint(num_rows, size=sample_batch_size)
+  ids = np.random.randint(first, last + 1, size=sample_batch_size)
+  if skip_boundaries:
+    invalid = np.flatnonzero(
+        step_types[rows, ids % max_length] == ts.StepType.LAST)
+    while invalid.size:
+      rows[invalid] = np.random.randint(num_rows, size=invalid.size)
+      ids[invalid] = np.random.randint(first, last + 1, size=invalid.size)
+      invalid = invalid[step_types[rows[invalid], ids[invalid] % max_length] ==
+                        ts.StepType.LAST]
+  return rows, ids
+
+
+def _gather_windows(columns, rows, ids, num_steps):
+  """Reads the windows starting at `ids` in `rows` as [B, T, ...] arrays."""
+  positions = (ids[:, None] + np.arange(num_steps)) % columns[0].shape[1]
+  return [column[rows[:, None], positions] for column in columns]
+
+
+@gin.configurable
+class NumpyReplayBuffer(object):
+  """A uniform replay buffer stored in preallocated NumPy arrays."""
+
+  def __init__(self,
+               data_spec,
+               batch_size,
+               max_length,
+               storage_dir=None,
+               float_dtype='float32'):
+    """Allocates the storage columns.
+
+    Args:
+      data_spec: The `Trajectory` spec of the stored items.
+      batch_size: Number of rows written by every `add_batch` call.
+      max_length: Number of items kept per row.
+      storage_dir: If set, every column is an `np.memmap` backed `.npy` file
+        in this directory and is reopened in place on restart.
+      float_dtype: Storage dtype of the floating point columns, 'float32' or
+        'float16'. Samples are cast back to the spec dtype.
+    """
+    self._data_spec = data_spec
+    self._flat_specs = tf.nest.flatten(data_spec)
+    self._batch_size = batch_size
+    self._max_length = max_length
+    self._storage_dir = storage_dir
+    self._lock = threading.Lock()
+    self._num_adds = 0
+    # Ids below this are not sampled, e.g. while a restore is streaming in.
+    self._min_valid_id = 0
+
+    float_dtype = np.dtype(float_dtype)
+    if storage_dir:
+      tf.io.gfile.makedirs(storage_dir)
+    self._columns = []
+    storage_dtypes = _storage_dtypes(data_spec, float_dtype)
+    for i, (spec, dtype) in enumerate(zip(self._flat_specs, storage_dtypes)):
+      shape = (batch_size, max_length) + tuple(spec.shape.as_list())
+      if storage_dir:
+        self._columns.append(self._open_memmap(
+            os.path.join(storage_dir, 'column_{}.npy'.format(i)), shape,
+            dtype))
+      else:
+        self._columns.append(np.zeros(shape, dtype=dtype))
+    # Memory-mapped buffers also persist how many adds may have reached the
+    # files, which can be ahead of the last checkpoint after a crash.
+    self._write_counter = None
+    if storage_dir:
+      self._write_counter = self._open_memmap(
+          os.path.join(storage_dir, 'write_counter.npy'), (1,), np.int64)
+    logging.info('Replay buffer storage: %.1f MB',
+                 sum(c.nbytes for c in self._columns) / 2.0**20)
+
+  @staticmethod
+  def _open_memmap(path, shape, dtype):
+    if os.path.exists(path):
+      column = np.load(path, mmap_mode='r+')
+      if column.shape == shape and column.dtype == dtype:
+        return column
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+  @property
+  def data_spec(self):
+    return self._data_spec
+
+  @property
+  def batch_size(self):
+    return self._batch_size
+
+  @property
+  def max_length(self):
+    return self._max_length
+
+  @property
+  def capacity(self):
+    return self._batch_size * self._max_length
+
+  @property
+  def storage_dir(self):
+    return self._storage_dir
+
+  @property
+  def num_adds(self):
+    return self._num_adds
+
+  def _add_batch_np(self, *flat_items):
+    with self._lock:
+      position = self._num_adds % self._max_length
+      if self._write_counter is not None:
+        # Counted before the write, so a crash mid-add is counted too.
+        self._write_counter[0] = self._num_adds + 1
+      for column, item in zip(self._columns, flat_items):
+        column[:, position] = item
+      self._num_adds += 1
+      return np.int64(self._num_adds)
+
+  def add_batch(self, items):
+    """Returns an op writing one [batch_size, ...] item per row."""
+    tf.nest.assert_same_structure(items, self._data_spec)
+    return tf.compat.v1.py_func(
+        self._add_batch_np, tf.nest.flatten(items), tf.int64, stateful=True,
+        name='add_batch')
+
+  def _valid_range(self, num_steps):
+    """Returns the [first, last] ids a window of num_steps may start at."""
+    with self._lock:
+      num_adds = self._num_adds
+      min_valid_id = self._min_valid_id
+    return (max(min_valid_id, num_adds - self._max_length),
+            num_adds - num_steps)
+
+  def _sample_ids(self, sample_batch_size, num_steps, skip_boundaries=False):
+    """Draws uniform (rows, ids) and the probability of each draw.
+
+    Blocks until every row holds at least one window of `num_steps` items.
+    With `skip_boundaries`, windows starting on a LAST step are redrawn, so
+    exactly `sample_batch_size` valid transitions are returned.
+    """
+    first, last = self._valid_range(num_steps)
+    while last < first:
+      time.sleep(0.01)
+      first, last = self._valid_range(num_steps)
+    rows, ids = _draw_windows(self._columns[0], first, last, sample_batch_size,
+                              skip_boundaries)
+    probabilities = np.full(
+        sample_batch_size, 1.0 / ((last - first + 1) * self._batch_size),
+        dtype=np.float32)
+    return rows, ids, probabilities
+
+  def _gather(self, rows, ids, num_steps):
+    """Reads the windows starting at `ids` in `rows` as [B, T, ...] arrays."""
+    return _gather_windows(self._columns, rows, ids, num_steps)
+
+  def _sample_np(self, sample_batch_size, num_steps, skip_boundaries=False):
+    rows, ids, probabilities = self._sample_ids(
+        sample_batch_size, num_steps, skip_boundaries)
+    flat = self._gather(rows, ids, num_steps)
+    flat = [f.astype(spec.dtype.as_numpy_dtype)
+            for f, spec in zip(flat, self._flat_specs)]
+    return flat + [(ids * self._batch_size + rows).astype(np.int64),
+                   probabilities]
+
+  def _sample_tensors(self, sample_batch_size, num_steps,
+                      skip_boundaries=False):
+    flat_dtypes = [spec.dtype for spec in self._flat_specs]
+    outputs = tf.compat.v1.py_func(
+        lambda: self._sample_np(sample_batch_size, num_steps, skip_boundaries),
+        [], flat_dtypes + [tf.int64, tf.float32], stateful=True)
+    flat, ids, probabilities = outputs[:-2], outputs[-2], outputs[-1]
+    for tensor, spec in zip(flat, self._flat_specs):
+      tensor.set_shape([sample_batch_size, num_steps] + spec.shape.as_list())
+    ids.set_shape([sample_batch_size])
+    probabilities.set_shape([sample_batch_size])
+    items = tf.nest.pack_sequence_as(self._data_spec, flat)
+    return items, tf_uniform_replay_buffer.BufferInfo(ids, probabilities)
+
+  def as_dataset(self, sample_batch_size, num_steps=None,
+                 num_parallel_calls=None, skip_boundaries=False):
+    """An infinite dataset of (items, BufferInfo) sampled uniformly.
+
+    Args:
+      sample_batch_size: Number of windows per element.
+      num_steps: Length of each window; windows never cross the write head.
+        If None, items have no time dimension.
+      num_parallel_calls: Parallelism of the sampling map.
+      skip_boundaries: Only return windows that do not start on a LAST step.
+    Returns:
+      A `tf.data.Dataset` of [sample_batch_size, num_steps, ...] items.
+    """
+    def _sample(unused_index):
+      items, info = self._sample_tensors(
+          sample_batch_size, num_steps or 1, skip_boundaries)
+      if num_steps is None:
+        items = tf.nest.map_structure(lambda t: tf.squeeze(t, 1), items)
+      return items, info
+
+    return tf.data.experimental.Counter().map(
+        _sample, num_parallel_calls=num_parallel_calls)
+
+  def get_state(self):
+    with self._lock:
+      return {'num_adds': self._num_adds}
+
+  def set_state(self, state, min_valid_id=0):
+    with self._lock:
+      self._num_adds = state['num_adds']
+      self._min_valid_id = min_valid_id
+
+  def restore_in_place_state(self, state):
+    """Restores the checkpointed `state` of a memory-mapped buffer.
+
+    Adds made after the checkpoint may already be in the files: the k-th of
+    them overwrote the oldest checkpointed id still held, `num_adds -
+    max_length + k - 1`. Those ids are excluded from sampling until new adds
+    replace them, and the adds themselves are dropped (`num_adds` goes back to
+    the checkpoint), so no window mixes data from both sides of the
+    checkpoint.
+
+    Returns:
+      The number of dropped adds.
+    """
+    num_adds = state['num_adds']
+    written = 0
+    if self._write_counter is not None:
+      written = max(0, int(self._write_counter[0]) - num_adds)
+      self._write_counter[0] = num_adds
+    # Ids >= num_adds are never sampled, so at most the whole old window is
+    # excluded.
+    min_valid_id = min(num_adds, num_adds - self._max_length + written)
+    self.set_state(state, min_valid_id=max(0, min_valid_id))
+    return written
+
+  def read_items(self, start_id, end_id):
+    """Copies the items with ids in [start_id, end_id) as [rows, n, ...]."""
+    positions = np.arange(start_id, end_id) % self._max_length
+    return [np.take(column, positions, axis=1) for column in self._columns]
+
+  def write_items(self, start_id, flat_items):
+    """Writes [rows, n, ...] items back at ids starting from `start_id`.
+
+    Items that newer adds have already evicted are dropped, and the restored
+    ids become available for sampling.
+    """
+    num_items = flat_items[0].shape[1]
+    with self._lock:
+      first_id = max(start_id, self._num_adds - self._max_length)
+      if first_id >= start_id + num_items:
+        return
+      offset = first_id - start_id
+      positions = np.arange(first_id, start_id + num_items) % self._max_length
+      for column, items in zip(self._columns, flat_items):
+        column[:, positions] = items[:, offset:]
+      self._min_valid_id = min(self._min_valid_id, first_id)
+
+  def save_snapshot(self, directory):
+    """Writes the columns and write counter for `ReplaySnapshot`."""
+    tf.io.gfile.makedirs(directory)
+    self.save_columns(directory)
+    with tf.io.gfile.GFile(os.path.join(directory, _METADATA_FILE), 'w') as f:
+      json.dump(self.get_state(), f)
+
+  def flush(self):
+    for column in self._columns:
+      if isinstance(column, np.memmap):
+        column.flush()
+
+  def save_columns(self, directory):
+    for i, column in enumerate(self._columns):
+      np.save(os.path.join(directory, 'column_{}.npy'.format(i)), column)
+
+  def load_columns(self, directory):
+    for i, column in enumerate(self._columns):
+      column[...] = np.load(
+          os.path.join(directory, 'column_{}.npy'.format(i)), mmap_mode='r')
+
+
+def _restore_priorities(replay_buffer, ckpt_dir):
+  """Restores the priorities of a `PrioritizedReplayBuffer`, if saved."""
+  if not isinstance(replay_buffer, PrioritizedReplayBuffer):
+    return
+  if not replay_buffer.load_priorities(ckpt_dir):
+    logging.warning('No replay priorities in %s; every restored transition '
+                    'starts at the max priority.', ckpt_dir)
+
+
+class NumpyReplayBufferCheckpointer(object):
+  """Drop-in for the replay buffer `common.Checkpointer` in `latent.py`.
+
+  Memory-mapped buffers already live on disk, so saving only flushes them and
+  records the write counter. In-memory buffers write their columns as `.npy`
+  files next to the counter.
+
+  A memory-mapped buffer restored after a crash may hold adds made after the
+  last save; they are dropped and the items they overwrote are not sampled
+  (see `NumpyReplayBuffer.restore_in_place_state`).
+
+  The sum-tree priorities of a `PrioritizedReplayBuffer` are saved and
+  restored with it.
+  """
+
+  def __init__(self, ckpt_dir, replay_buffer):
+    self._ckpt_dir = ckpt_dir
+    self._replay_buffer = replay_buffer
+    tf.io.gfile.makedirs(ckpt_dir)
+
+  def _in_place(self):
+    return self._replay_buffer.storage_dir is not None
+
+  def save(self, global_step):
+    if self._in_place():
+      self._replay_buffer.flush()
+    else:
+      self._replay_buffer.save_columns(self._ckpt_dir)
+    if isinstance(self._replay_buffer, PrioritizedReplayBuffer):
+      self._replay_buffer.save_priorities(self._ckpt_dir)
+    state = dict(self._replay_buffer.get_state(), global_step=int(global_step))
+    with tf.io.gfile.GFile(
+        os.path.join(self._ckpt_dir, _METADATA_FILE), 'w') as f:
+      json.dump(state, f)
+
+  def initialize_or_restore(self, sess=None):
+    del sess  # The buffer lives outside the TF graph.
+    metadata_path = os.path.join(self._ckpt_dir, _METADATA_FILE)
+    if not tf.io.gfile.exists(metadata_path):
+      return
+    with tf.io.gfile.GFile(metadata_path) as f:
+      state = json.load(f)
+    if self._in_place():
+      dropped = self._replay_buffer.restore_in_place_state(state)
+      if dropped:
+        logging.info('Dropped %d replay adds made after the checkpoint and '
+                     'the items they overwrote.', dropped)
+    else:
+      self._replay_buffer.load_columns(self._ckpt_dir)
+      self._replay_buffer.set_state(state)
+    _restore_priorities(self._replay_buffer, self._ckpt_dir)
+    logging.info('Restored replay buffer with %d items per row from step %d.',
+                 state['num_adds'], state['global_step'])
+
+
+class ReplaySnapshot(object):
+  """A read-only replay buffer written by `NumpyReplayBuffer.save_snapshot`.
+
+  The columns are opened with `mmap_mode='r'`, so every process that maps
+  the same snapshot shares its pages through the OS page cache instead of
+  holding a private copy.
+  """
+
+  def __init__(self, directory, data_spec):
+    """Maps the snapshot.
+
+    Args:
+      directory: Directory holding `metadata.json` and the column files, e.g.
+        a snapshot or the checkpoint dir of an in-memory `NumpyReplayBuffer`.
+      data_spec: The `Trajectory` spec the snapshot was written with.
+
+    Raises:
+      ValueError: If the columns do not match `data_spec`: the item shapes
+        differ, or the dtypes differ from the storage dtypes of
+        `NumpyReplayBuffer` (floating point columns may be float32 or
+        float16).
+    """
+    with tf.io.gfile.GFile(os.path.join(directory, _METADATA_FILE)) as f:
+      self._num_adds = json.load(f)['num_adds']
+    flat_specs = tf.nest.flatten(data_spec)
+    self._columns = [
+        np.load(os.path.join(directory, 'column_{}.npy'.format(i)),
+                mmap_mode='r')
+        for i in range(len(flat_specs))]
+    storage_dtypes = _storage_dtypes(data_spec, np.float32)
+    for column, spec, dtype in zip(self._columns, flat_specs, storage_dtypes):
+      if column.shape[2:] != tuple(spec.shape.as_list()):
+        raise ValueError('Snapshot column of shape {} does not match {}.'.format(
+            column.shape, spec))
+      dtype_matches = (
+          np.issubdtype(column.dtype, np.floating) if spec.dtype.is_floating
+          else column.dtype == dtype)
+      if not dtype_matches:
+        raise ValueError('Snapshot column of dtype {} does not match {}.'.format(
+            column.dtype, spec))
+    self._batch_size, self._max_length = self._columns[0].shape[:2]
+    logging.info('Mapped replay snapshot %s with %d items per row.',
+                 directory, min(self._num_adds, self._max_length))
+
+  @property
+  def columns(self):
+    return self._columns
+
+  @property
+  def batch_size(self):
+    return self._batch_size
+
+  def valid_range(self, num_steps):
+    """Returns the [first, last] ids a window of num_steps may start at."""
+    return (max(0, self._num_adds - self._max_length),
+            self._num_adds - num_steps)
+
+
+@gin.configurable
+class SnapshotOverlayReplayBuffer(NumpyReplayBuffer):
+  """Samples from a shared read-only snapshot plus a private overlay.
+
+  New transitions go to this buffer's own columns (the overlay); the
+  snapshot is never written. Windows are drawn uniformly over the union of
+  both, and the checkpointers only save the overlay. Samples from the
+  snapshot get negative ids. Size the overlay for the transitions of the
+  finetune run rather than the snapshot, as every job holds its own.
+  """
+
+  def __init__(self,
+               data_spec,
+               batch_size,
+               max_length,
+               snapshot_dir,
+               storage_dir=None,
+               float_dtype='float32'):
+    """Maps the snapshot and allocates the overlay.
+
+    Args:
+      data_spec: See `NumpyReplayBuffer`.
+      batch_size: See `NumpyReplayBuffer`.
+      max_length: Overlay items kept per row.
+      snapshot_dir: Directory of the `ReplaySnapshot` to sample from.
+      storage_dir: See `NumpyReplayBuffer`.
+      float_dtype: See `NumpyReplayBuffer`.
+
+    Raises:
+      ValueError: If the snapshot does not match `data_spec`.
+    """
+    # Checked before the overlay is allocated.
+    self._snapshot = ReplaySnapshot(snapshot_dir, data_spec)
+    super(SnapshotOverlayReplayBuffer, self).__init__(
+        data_spec, batch_size, max_length, storage_dir=storage_dir,
+        float_dtype=float_dtype)
+
+  def _sample_np(self, sample_batch_size, num_steps, skip_boundaries=False):
+    snapshot_first, snapshot_last = self._snapshot.valid_range(num_steps)
+    num_snapshot_windows = max(snapshot_last - snapshot_first + 1, 0) * (
+        self._snapshot.batch_size)
+    first, last = self._valid_range(num_steps)
+    num_windows = max(last - first + 1, 0) * self._batch_size
+    while num_snapshot_windows + num_windows == 0:
+      time.sleep(0.01)
+      first, last = self._valid_range(num_steps)
+      num_windows = max(last - first + 1, 0) * self._batch_size
+    total_windows = num_snapshot_windows + num_windows
+
+    num_from_snapshot = np.random.binomial(
+        sample_batch_size, float(num_snapshot_windows) / total_windows)
+    snapshot_rows, snapshot_ids = _draw_windows(
+        self._snapshot.columns[0], snapshot_first, snapshot_last,
+        num_from_snapshot, skip_boundaries)
+    rows, ids = _draw_windows(
+        self._columns[0], first, last, sample_batch_size - num_from_snapshot,
+        skip_boundaries)
+
+    flat = [
+        np.concatenate([snapshot_items, items]).astype(
+            spec.dtype.as_numpy_dtype)
+        for snapshot_items, items, spec in zip(
+            _gather_windows(self._snapshot.columns, snapshot_rows,
+                            snapshot_ids, num_steps),
+            _gather_windows(self._columns, rows, ids, num_steps),
+            self._flat_specs)]
+    ids = np.concatenate([
+        -1 - (snapshot_ids * self._snapshot.batch_size + snapshot_rows),
+        ids * self._batch_size + rows]).astype(np.int64)
+    probabilities = np.full(
+        sample_batch_size, 1.0 / total_windows, dtype=np.float32)
+    return flat + [ids, probabilities]
+
+
+class SumTree(object):
+  """Array-based sum-tree over a fixed number of leaves.
+
+  Node i has children 2i and 2i+1 and the root is node 1. Updates and
+  prefix-sum searches handle a whole batch of leaves per tree level, so both
+  cost O(log N) vectorized NumPy ops regardless of the batch size.
+  """
+
+  def __init__(self, num_leaves):
+    self._depth = int(np.ceil(np.log2(max(num_leaves, 2))))
+    self._first_leaf = 2**self._depth
+    self._nodes = np.zeros(2 * self._first_leaf, dtype=np.float64)
+
+  @property
+  def total(self):
+    return self._nodes[1]
+
+  def get(self, leaves):
+    return self._nodes[self._first_leaf + leaves]
+
+  def set(self, leaves, values):
+    nodes = self._first_leaf + np.asarray(leaves)
+    self._nodes[nodes] = values
+    for _ in range(self._depth):
+      nodes = np.unique(nodes // 2)
+      self._nodes[nodes] = self._nodes[2 * nodes] + self._nodes[2 * nodes + 1]
+
+  def find(self, values):
+    """Returns the leaves whose prefix-sum interval contains each value."""
+    values = np.array(values, dtype=np.float64)
+    nodes = np.ones(len(values), dtype=np.int64)
+    for _ in range(self._depth):
+      left = self._nodes[2 * nodes]
+      go_right = values >= left
+      values -= np.where(go_right, left, 0.0)
+      nodes = 2 * nodes + go_right
+    return nodes - self._first_leaf
+
+
+@gin.configurable
+class PrioritizedReplayBuffer(NumpyReplayBuffer):
+  """Proportional prioritized replay over 2-step transitions.
+
+  Each slot's leaf holds the priority of the transition starting there. A
+  slot only gets a priority once its successor has been written, and slots
+  whose step is LAST keep priority 0, so every draw is a valid transition.
+  New transitions start at the largest priority seen so far.
+  """
+
+  def __init__(self,
+               data_spec,
+               batch_size,
+               max_length,
+               storage_dir=None,
+               float_dtype='float32',
+               alpha=0.6,
+               beta=0.4,
+               beta_annealing_steps=1000000,
+               priority_epsilon=1e-6):
+    """Creates the buffer and its sum-tree.
+
+    Args:
+      data_spec: See `NumpyReplayBuffer`.
+      batch_size: See `NumpyReplayBuffer`.
+      max_length: See `NumpyReplayBuffer`.
+      storage_dir: See `NumpyReplayBuffer`.
+      float_dtype: See `NumpyReplayBuffer`.
+      alpha: Priority exponent; 0 is uniform sampling.
+      beta: Initial importance-sampling exponent, annealed linearly to 1.
+      beta_annealing_steps: Priority updates over which beta reaches 1.
+      priority_epsilon: Added to |TD error| so no transition gets stuck at 0.
+    """
+    super(PrioritizedReplayBuffer, self).__init__(
+        data_spec, batch_size, max_length, storage_dir=storage_dir,
+        float_dtype=float_dtype)
+    self._tree = SumTree(batch_size * max_length)
+    self._tree_lock = threading.Lock()
+    self._alpha = alpha
+    self._beta = beta
+    self._beta_annealing_steps = beta_annealing_steps
+    self._priority_epsilon = priority_epsilon
+    self._max_priority = 1.0
+    self._num_priority_updates = 0
+
+  def _leaves(self, ids):
+    """Leaf index of id `ids` in every row, as a [rows * len(ids)] array."""
+    positions = np.asarray(ids) % self._max_length
+    rows = np.arange(self._batch_size)[:, None]
+    return (rows * self._max_length + positions).reshape([-1])
+
+  def _enable(self, ids):
+    """Gives the transitions starting at `ids` the max priority."""
+    if not len(ids):
+      return
+    leaves = self._leaves(ids)
+    step_types = self._columns[0].reshape([-1])[leaves]
+    with self._tree_lock:
+      self._tree.set(leaves, np.where(step_types == ts.StepType.LAST, 0.0,
+                                      self._max_priority))
+
+  def _add_batch_np(self, *flat_items):
+    num_adds = super(PrioritizedReplayBuffer, self)._add_batch_np(*flat_items)
+    new_id = num_adds - 1
+    with self._tree_lock:
+      # The new slot has no successor yet and replaces the evicted one.
+      self._tree.set(self._leaves([new_id]), 0.0)
+    self._enable([new_id - 1] if new_id > 0 else [])
+    return num_adds
+
+  def set_state(self, state, min_valid_id=0):
+    super(PrioritizedReplayBuffer, self).set_state(state, min_valid_id)
+    num_adds = state['num_adds']
+    first = max(min_valid_id, num_adds - self._max_length)
+    self._enable(np.arange(first, num_adds - 1))
+
+  def save_priorities(self, directory):
+    """Writes the sum-tree leaves and the priority statistics to `directory`."""
+    with self._tree_lock:
+      leaves = self._tree.get(np.arange(self.capacity))
+      max_priority = self._max_priority
+      num_priority_updates = self._num_priority_updates
+    with tf.io.gfile.GFile(os.path.join(directory, _PRIORITIES_FILE),
+                           'wb') as f:
+      np.savez(f, leaves=leaves, max_priority=max_priority,
+               num_priority_updates=num_priority_updates)
+
+  def load_priorities(self, directory):
+    """Restores the priorities written by `save_priorities`.
+
+    Call it after the items are restored: only transitions that are valid
+    again get their saved priority, the others keep their current one.
+
+    Returns:
+      False if `directory` holds no priorities.
+    """
+    path = os.path.join(directory, _PRIORITIES_FILE)
+    if not tf.io.gfile.exists(path):
+      return False
+    with tf.io.gfile.GFile(path, 'rb') as f, np.load(f) as data:
+      saved = data['leaves']
+      max_priority = float(data['max_priority'])
+      num_priority_updates = int(data['num_priority_updates'])
+    if saved.shape != (self.capacity,):
+      raise ValueError('Saved priorities of shape {} do not match a buffer '
+                       'of capacity {}.'.format(saved.shape, self.capacity))
+    leaves = np.arange(self.capacity)
+    with self._tree_lock:
+      current = self._tree.get(leaves)
+      self._tree.set(leaves, np.where((current > 0) & (saved > 0), saved,
+                                      current))
+      self._max_priority = max(self._max_priority, max_priority)
+      self._num_priority_updates = max(self._num_priority_updates,
+                                       num_priority_updates)
+    return True
+
+  def write_items(self, start_id, flat_items):
+    super(PrioritizedReplayBuffer, self).write_items(start_id, flat_items)
+    with self._lock:
+      first = max(start_id, self._num_adds - self._max_length)
+      last = min(start_id + flat_items[0].shape[1], self._num_adds - 1)
+    self._enable(np.arange(first, last))
+
+  def _sample_prioritized_np(self, sample_batch_size):
+    first, last = self._valid_range(2)
+    while last < first or self._tree.total <= 0:
+      time.sleep(0.01)
+      first, last = self._valid_range(2)
+    with self._tree_lock:
+      total = self._tree.total
+      # Stratified draws: one uniform value per equal slice of the mass.
+      values = (np.arange(sample_batch_size) +
+                np.random.uniform(size=sample_batch_size)) * (
+                    total / sample_batch_size)
+      leaves = self._tree.find(np.minimum(values, np.nextafter(total, 0)))
+      probabilities = self._tree.get(leaves) / total
+    rows = leaves // self._max_length
+    positions = leaves % self._max_length
+
+    fraction = min(1.0, float(self._num_priority_updates) /
+                   max(self._beta_annealing_steps, 1))
+    beta = self._beta + fraction * (1.0 - self._beta)
+    num_valid = (last - first + 1) * self._batch_size
+    weights = np.power(num_valid * np.maximum(probabilities, 1e-12), -beta)
+    weights /= weights.max()
+
+    flat = self._gather(rows, positions, 2)
+    flat = [f.astype(spec.dtype.as_numpy_dtype)
+            for f, spec in zip(flat, self._flat_specs)]
+    return flat + [leaves.astype(np.int64), probabilities.astype(np.float32),
+                   weights.astype(np.float32)]
+
+  def _sample_tensors(self, sample_batch_size, num_steps,
+                      skip_boundaries=False):
+    del skip_boundaries  # Boundary slots always have priority 0.
+    if num_steps != 2:
+      raise ValueError('PrioritizedReplayBuffer samples 2-step transitions.')
+    flat_dtypes = [spec.dtype for spec in self._flat_specs]
+    outputs = tf.compat.v1.py_func(
+        lambda: self._sample_prioritized_np(sample_batch_size), [],
+        flat_dtypes + [tf.int64, tf.float32, tf.float32], stateful=True)
+    flat, info = outputs[:-3], outputs[-3:]
+    for tensor, spec in zip(flat, self._flat_specs):
+      tensor.set_shape([sample_batch_size, num_steps] + spec.shape.as_list())
+    for tensor in info:
+      tensor.set_shape([sample_batch_size])
+    items = tf.nest.pack_sequence_as(self._data_spec, flat)
+    return items, PrioritizedBufferInfo(*info)
+
+  def _update_priorities_np(self, leaves, td_errors):
+    priorities = np.power(np.abs(td_errors) + self._priority_epsilon,
+                          self._alpha)
+    with self._tree_lock:
+      # Slots that cannot start a transition any more (the newest slot of a
+      # row after a wrap-around) must stay at priority 0.
+      live = self._tree.get(leaves) > 0
+      self._tree.set(leaves[live], priorities[live])
+      self._max_priority = max(self._max_priority, priorities.max())
+      self._num_priority_updates += 1
+    return np.int64(self._num_priority_updates)
+
+  def update_priorities(self, ids, td_errors):
+    """Returns an op setting the priorities of sampled `ids` from TD errors."""
+    return tf.compat.v1.py_func(
+        self._update_priorities_np,
+        [ids, tf.cast(td_errors, tf.float64)], tf.int64, stateful=True,
+        name='update_priorities')
+
+
+def _sample_valid_transitions(replay_buffer, batch_size):
+  """Draws exactly `batch_size` non-boundary 2-step windows in graph.
+
+  Boundary windows of the first draw are replaced from fresh draws until
+  none is left; with 1000-step episodes this almost never loops.
+  """
+  def _draw():
+    return replay_buffer.get_next(sample_batch_size=batch_size, num_steps=2)
+
+  def _has_boundary(items, unused_info):
+    return tf.reduce_any(items.is_boundary()[:, 0])
+
+  def _redraw(items, info):
+    keep = ~items.is_boundary()[:, 0]
+    new_items, new_info = _draw()
+    return tf.nest.map_structure(
+        lambda old, new: tf.compat.v1.where(keep, old, new),
+        (items, info), (new_items, new_info))
+
+  items, info = _draw()
+  return tf.while_loop(_has_boundary, _redraw, (items, info),
+                       parallel_iterations=1, back_prop=False)
+
+
+def transition_dataset(replay_buffer, batch_size):
+  """A dataset of [batch_size, 2, ...] transitions that never cross episodes.
+
+  Works with both `TFUniformReplayBuffer` and `NumpyReplayBuffer` and uses an
+  autotuned prefetch instead of a fixed-size one.
+  """
+  autotune = tf.data.experimental.AUTOTUNE
+  if isinstance(replay_buffer, NumpyReplayBuffer):
+    dataset = replay_buffer.as_dataset(
+        sample_batch_size=batch_size, num_steps=2,
+        num_parallel_calls=autotune, skip_boundaries=True)
+  else:
+    dataset = tf.data.experimental.Counter().map(
+        lambda _: _sample_valid_transitions(replay_buffer, batch_size),
+        num_parallel_calls=autotune)
+  return dataset.prefetch(autotune)
+
+
+_MANIFEST_FILE = 'manifest.json'
+
+
+class SegmentedReplayCheckpointer(object):
+  """Append-only replay checkpoints for an in-memory `NumpyReplayBuffer`.
+
+  Every `save` writes only the items added since the previous save as one
+  `.npz` segment and updates a small manifest; segments whose items have all
+  been evicted from the buffer are deleted. `initialize_or_restore` returns
+  right away and streams the segments back newest first on a background
+  thread, so training resumes on whatever has been loaded so far; the
+  priorities of a `PrioritizedReplayBuffer` are restored once all segments
+  are in. Call `wait_for_restore` before saving or exporting the buffer; it
+  also re-raises an error that stopped the restore.
+  """
+
+  def __init__(self, ckpt_dir, replay_buffer):
+    self._ckpt_dir = ckpt_dir
+    self._replay_buffer = replay_buffer
+    self._segments = []
+    self._last_saved_id = 0
+    self._loader = None
+    # exc_info of a failed streamed restore, re-raised by wait_for_restore.
+    self._restore_error = None
+    tf.io.gfile.makedirs(ckpt_dir)
+
+  def _read_manifest(self):
+    manifest_path = os.path.join(self._ckpt_dir, _MANIFEST_FILE)
+    if not tf.io.gfile.exists(manifest_path):
+      return None
+    with tf.io.gfile.GFile(manifest_path) as f:
+      return json.load(f)
+
+  def _write_manifest(self, manifest):
+    manifest_path = os.path.join(self._ckpt_dir, _MANIFEST_FILE)
+    with tf.io.gfile.GFile(manifest_path + '.tmp', 'w') as f:
+      json.dump(manifest, f)
+    tf.io.gfile.rename(manifest_path + '.tmp', manifest_path, overwrite=True)
+
+  def save(self, global_step):
+    num_adds = self._replay_buffer.get_state()['num_adds']
+    first_live_id = max(0, num_adds - self._replay_buffer.max_length)
+    start_id = max(self._last_saved_id, first_live_id)
+    if num_adds > start_id:
+      filename = 'segment_{:012d}_{:012d}.npz'.format(start_id, num_adds)
+      with tf.io.gfile.GFile(os.path.join(self._ckpt_dir, filename),
+                             'wb') as f:
+        np.savez(f, *self._replay_buffer.read_items(start_id, num_adds))
+      self._segments.append(
+          {'file': filename, 'start': start_id, 'end': num_adds})
+
+    live_segments = []
+    for segment in self._segments:
+      if segment['end'] > first_live_id:
+        live_segments.append(segment)
+      else:
+        tf.io.gfile.remove(os.path.join(self._ckpt_dir, segment['file']))
+    self._segments = live_segments
+    self._last_saved_id = num_adds
+    if isinstance(self._replay_buffer, PrioritizedReplayBuffer):
+      self._replay_buffer.save_priorities(self._ckpt_dir)
+    self._write_manifest({'segments': self._segments,
+                          'num_adds': num_adds,
+                          'global_step': int(global_step)})
+
+  def _load_segments(self, segments):
+    try:
+      for segment in reversed(segments):
+        path = os.path.join(self._ckpt_dir, segment['file'])
+        with tf.io.gfile.GFile(path, 'rb') as f, np.load(f) as data:
+          items = [data['arr_{}'.format(i)] for i in range(len(data.files))]
+        self._replay_buffer.write_items(segment['start'], items)
+      # Until here the streamed transitions sample at the max priority.
+      _restore_priorities(self._replay_buffer, self._ckpt_dir)
+    except Exception:  # pylint: disable=broad-except
+      logging.exception('Streaming the replay segments failed.')
+      self._restore_error = sys.exc_info()
+      return
+    logging.info('Finished streaming %d replay segments.', len(segments))
+
+  def initialize_or_restore(self, sess=None):
+    del sess  # The buffer lives outside the TF graph.
+    manifest = self._read_manifest()
+    if manifest is None:
+      return
+    self._segments = manifest['segments']
+    self._last_saved_id = manifest['num_adds']
+    # Nothing is sampleable until the first (newest) segment has landed.
+    self._replay_buffer.set_state({'num_adds': manifest['num_adds']},
+                                  min_valid_id=manifest['num_adds'])
+    self._loader = threading.Thread(
+        target=self._load_segments, args=(list(self._segments),))
+    self._loader.daemon = True
+    self._loader.start()
+    logging.info('Streaming %d replay segments from step %d.',
+                 len(self._segments), manifest['global_step'])
+
+  def wait_for_restore(self):
+    """Blocks until the streamed restore is done.
+
+    Raises:
+      The exception that stopped the streamed restore, if any.
+    """
+    if self._loader is not None:
+      self._loader.join()
+      self._loader = None
+    if self._restore_error is not None:
+      six.reraise(*self._restore_error)
@@ -0,0 +1,248 @@
+"""Offline replay datasets in a sharded, compressed columnar format.
+
+`ReplayBufferExporter` streams the contents of a `TFUniformReplayBuffer` or a
+`NumpyReplayBuffer` to `shard-NNNNN.npz` files, one compressed array per
+trajectory field (step_type, observation, action, next_step_type, reward,
+discount, ...), plus a `manifest.json`. Every shard holds a bounded number of
+consecutive time indices of each buffer row, so only one shard is in memory at
+a time. Exports are incremental: each call appends shards for the ids added
+since the last one in the manifest, so it can run at every replay checkpoint.
+`load_dataset` reads the shards back into a `tf.data` pipeline of
+[batch_size, num_steps, ...] trajectories.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from absl import logging
+
+import latent_replay_buffer
+from tf_agents.trajectories import time_step as ts
+
+_MANIFEST_FILE = 'manifest.json'
+_SHARD_FILE = 'shard-{:05d}.npz'
+
+
+def _column_names(data_spec):
+  """Names the flattened fields of a `Trajectory` spec by their field name."""
+  names = []
+  for field in data_spec._fields:
+    flat = tf.nest.flatten(getattr(data_spec, field))
+    if len(flat) == 1:
+      names.append(field)
+    else:
+      names.extend('{}/{}'.format(field, i) for i in range(len(flat)))
+  return names
+
+
+class ReplayBufferExporter(object):
+  """Writes the valid items of a replay buffer as columnar shards."""
+
+  def __init__(self, replay_buffer):
+    """Builds the read ops; call before the graph is finalized.
+
+    Args:
+      replay_buffer: A `TFUniformReplayBuffer` or a `NumpyReplayBuffer`.
+    """
+    self._replay_buffer = replay_buffer
+    self._data_spec = replay_buffer.data_spec
+    self._names = _column_names(self._data_spec)
+    self._is_numpy = isinstance(replay_buffer,
+                                latent_replay_buffer.NumpyReplayBuffer)
+    if self._is_numpy:
+      self._max_length = replay_buffer.max_length
+      return
+
+    # The public TF buffer APIs only sample, so reading items by id needs the
+    # table itself.
+    for attr in ('_data_table', '_get_last_id'):
+      if not hasattr(replay_buffer, attr):
+        raise ValueError(
+            'Cannot export a {} without `{}`; expected a '
+            'TFUniformReplayBuffer or a NumpyReplayBuffer.'.format(
+                type(replay_buffer).__name__, attr))
+    # TFUniformReplayBuffer keeps item (row b, id t) at table row
+    # b * max_length + t % max_length.
+    batch_size = replay_buffer.batch_size
+    self._max_length = replay_buffer.capacity // batch_size
+    self._ids_ph = tf.compat.v1.placeholder(tf.int64, [None], name='ids')
+    num_ids = tf.shape(self._ids_ph)[0]
+    table_rows = (
+        tf.range(batch_size, dtype=tf.int64)[:, None] * self._max_length +
+        (self._ids_ph % self._max_length)[None, :])
+    items = replay_buffer._data_table.read(tf.reshape(table_rows, [-1]))
+    self._read_op = [
+        tf.reshape(t, tf.concat([[batch_size, num_ids], tf.shape(t)[1:]], 0))
+        for t in tf.nest.flatten(items)]
+    self._num_adds_op = replay_buffer._get_last_id() + 1
+
+  def _num_adds(self, sess):
+    if self._is_numpy:
+      return self._replay_buffer.num_adds
+    return int(sess.run(self._num_adds_op))
+
+  def _read(self, sess, start_id, end_id):
+    if self._is_numpy:
+      return self._replay_buffer.read_items(start_id, end_id)
+    return sess.run(self._read_op,
+                    feed_dict={self._ids_ph: np.arange(start_id, end_id)})
+
+  def _load_manifest(self, output_dir, num_adds):
+    """Returns the columns and shards already exported below `num_adds`."""
+    path = os.path.join(output_dir, _MANIFEST_FILE)
+    if not tf.io.gfile.exists(path):
+      return None, []
+    with tf.io.gfile.GFile(path) as f:
+      manifest = json.load(f)
+    shards = manifest['shards']
+    # After a restore from an older replay checkpoint, the ids past its
+    # num_adds are added again with new contents.
+    kept = [shard for shard in shards
+            if shard['start_id'] + shard['num_steps'] <= num_adds]
+    if len(kept) < len(shards):
+      logging.warning('Dropping %d exported replay shards past id %d.',
+                      len(shards) - len(kept), num_adds)
+    return manifest['columns'] or None, kept
+
+  def export(self, sess, output_dir, steps_per_shard=10000):
+    """Appends the items added since the last export to `output_dir`.
+
+    Shards continue from the end of the existing manifest, oldest items
+    first. Items evicted from the buffer since then are skipped with a
+    warning, so export at least every `max_length` adds to keep them all.
+
+    Args:
+      sess: The session holding the buffer variables.
+      output_dir: Directory for the shards and the manifest.
+      steps_per_shard: Time indices per shard; a shard holds this many items
+        of every buffer row.
+    Returns:
+      The number of items written by this call, summed over rows.
+    """
+    tf.io.gfile.makedirs(output_dir)
+    num_adds = self._num_adds(sess)
+    columns, shards = self._load_manifest(output_dir, num_adds)
+    exported_id = (shards[-1]['start_id'] + shards[-1]['num_steps']
+                   if shards else 0)
+    first_id = max(exported_id, num_adds - self._max_length)
+    if first_id > exported_id:
+      logging.warning('Replay ids %d to %d were evicted before export.',
+                      exported_id, first_id)
+    num_new_shards = 0
+    for start_id in range(first_id, num_adds, steps_per_shard):
+      end_id = min(start_id + steps_per_shard, num_adds)
+      flat_items = self._read(sess, start_id, end_id)
+      path = os.path.join(output_dir, _SHARD_FILE.format(len(shards)))
+      with tf.io.gfile.GFile(path, 'wb') as f:
+        np.savez_compressed(f, **dict(zip(self._names, flat_items)))
+      shards.append({'file': os.path.basename(path),
+                     'start_id': start_id,
+                     'num_steps': end_id - start_id})
+      num_new_shards += 1
+      if columns is None:
+        columns = [{'name': name, 'dtype': items.dtype.name,
+                    'shape': list(items.shape[2:])}
+                   for name, items in zip(self._names, flat_items)]
+    manifest = {'batch_size': self._replay_buffer.batch_size,
+                'columns': columns or [],
+                'shards': shards}
+    # Replace the manifest only once its shards are written, so that an
+    # interrupted export leaves the previous one readable.
+    manifest_path = os.path.join(output_dir, _MANIFEST_FILE)
+    with tf.io.gfile.GFile(manifest_path + '.tmp', 'w') as f:
+      json.dump(manifest, f, indent=2)
+    tf.io.gfile.rename(manifest_path + '.tmp', manifest_path, overwrite=True)
+    num_items = max(0, num_adds - first_id) * self._replay_buffer.batch_size
+    logging.info('Exported %d replay items in %d new shards to %s.',
+                 num_items, num_new_shards, output_dir)
+    return num_items
+
+
+def _shard_windows(path, names, num_steps, skip_boundaries):
+  """Returns every window of `num_steps` in one shard as [N, T, ...] columns.
+
+  Windows do not cross shard files, so each row loses `num_steps - 1` windows
+  per shard boundary.
+  """
+  with tf.io.gfile.GFile(path, 'rb') as f:
+    shard = np.load(f)
+    flat = [shard[name] for name in names]
+  length = flat[0].shape[1]
+  starts = np.arange(max(length - num_steps + 1, 0))
+  positions = starts[:, None] + np.arange(num_steps)
+  windows = [column[:, positions].reshape((-1, num_steps) + column.shape[2:])
+             for column in flat]
+  if skip_boundaries:
+    # step_type is the first Trajectory field.
+    keep = windows[0][:, 0] != ts.StepType.LAST
+    windows = [w[keep] for w in windows]
+  return windows
+
+
+def load_dataset(data_dir,
+                 data_spec,
+                 batch_size,
+                 num_steps=2,
+                 skip_boundaries=True,
+                 shuffle_buffer_size=100000,
+                 num_parallel_reads=4,
+                 repeat=True):
+  """A `tf.data` pipeline of trajectories read from exported shards.
+
+  Args:
+    data_dir: Directory written by `ReplayBufferExporter.export`.
+    data_spec: The `Trajectory` spec of the exported buffer.
+    batch_size: Windows per element.
+    num_steps: Length of each window.
+    skip_boundaries: Drop windows that start on a LAST step.
+    shuffle_buffer_size: Windows held in the shuffle buffer.
+    num_parallel_reads: Shards decompressed concurrently.
+    repeat: Cycle over the shards forever.
+  Returns:
+    A dataset of `Trajectory`s with [batch_size, num_steps, ...] tensors in
+    the dtypes of `data_spec`.
+  """
+  with tf.io.gfile.GFile(os.path.join(data_dir, _MANIFEST_FILE)) as f:
+    manifest = json.load(f)
+  names = _column_names(data_spec)
+  flat_specs = tf.nest.flatten(data_spec)
+  paths = [os.path.join(data_dir, shard['file'])
+           for shard in manifest['shards']]
+  output_dtypes = tuple(
+      tf.as_dtype(column['dtype']) for column in manifest['columns'])
+  output_shapes = tuple(
+      tf.TensorShape([None, num_steps] + column['shape'])
+      for column in manifest['columns'])
+
+  def _read_shard(path):
+    def _generator(path):
+      # from_generator passes the path in as bytes.
+      yield tuple(_shard_windows(path.decode(), names, num_steps,
+                                 skip_boundaries))
+    return tf.data.Dataset.from_generator(
+        _generator, output_dtypes, output_shapes, args=(path,))
+
+  def _to_trajectory(*flat):
+    flat = [tf.cast(t, spec.dtype) for t, spec in zip(flat, flat_specs)]
+    return tf.nest.pack_sequence_as(data_spec, flat)
+
+  dataset = tf.data.Dataset.from_tensor_slices(paths)
+  if repeat:
+    dataset = dataset.shuffle(len(paths)).repeat()
+  dataset = dataset.interleave(
+      _read_shard, cycle_length=num_parallel_reads,
+      num_parallel_calls=num_parallel_reads)
+  dataset = dataset.apply(tf.data.experimental.unbatch())
+  dataset = dataset.shuffle(shuffle_buffer_size)
+  dataset = dataset.batch(batch_size, drop_remainder=True)
+  return dataset.map(
+      _to_trajectory,
+      num_parallel_calls=tf.data.experimental.AUTOTUNE).prefetch(
+          tf.data.experimental.AUTOTUNE)
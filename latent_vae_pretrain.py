@@ -0,0 +1,228 @@
+"""Offline pretraining of the latent action VAE from an exported replay dataset.
+
+Trains only the `ZInferenceNetwork`/`ActionGenerator` pair on the
+(observation, action) pairs of a dataset written by
+`latent_replay_dataset.ReplayBufferExporter`, with large batches and many
+steps per session call. Checkpoints go to `root_dir`/train with the object
+layout of `train_eval`'s train checkpoints, so a finetune run can start from
+them with `--init_from`.
+To run:
+```bash
+python latent_vae_pretrain.py \
+  --root_dir=./vae_pretrain \
+  --data_dir=./output/replay_export
+python latent.py --root_dir=./finetune --finetune --init_from=./vae_pretrain
+```
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+
+from absl import app
+from absl import flags
+from absl import logging
+
+import gin
+import tensorflow as tf
+
+import latent_action_generator
+import latent_agent
+import latent_inference_network
+import latent_replay_dataset
+from tf_agents.environments import suite_gym
+from tf_agents.specs import tensor_spec
+from tf_agents.trajectories import trajectory
+from tf_agents.utils import common
+
+# Registers the cheetah target-velocity envs (BackCheetah-v0, ...).
+import gym_cheetah
+
+flags.DEFINE_string('root_dir', None,
+                    'Root directory for writing summaries/checkpoints.')
+flags.DEFINE_string('data_dir', None,
+                    'Directory of the exported replay dataset.')
+flags.DEFINE_multi_string('gin_file', None,
+                          'Path to the gin config files.')
+flags.DEFINE_multi_string('gin_param', None, 'Gin binding to pass through.')
+
+FLAGS = flags.FLAGS
+
+
+@gin.configurable
+def train_vae(
+    root_dir,
+    data_dir,
+    env_name='HalfCheetah-v2',
+    env_load_fn=suite_gym.load,
+    latent_dtype=tf.float32,
+    num_iterations=100000,
+    batch_size=4096,
+    steps_per_run=100,
+    learning_rate=1e-3,
+    shuffle_buffer_size=1000000,
+    num_parallel_reads=8,
+    num_threads=0,
+    checkpoint_interval=10000,
+    log_interval=1000):
+  """Trains the latent action VAE offline.
+
+  Args:
+    root_dir: Directory for summaries and checkpoints.
+    data_dir: Directory written by `ReplayBufferExporter.export`.
+    env_name: Env whose specs the dataset was collected with.
+    env_load_fn: Function creating the py environment; only its specs are
+      used.
+    latent_dtype: dtype of the networks and loss; must match the `latent_dtype`
+      of the `train_eval` runs that load the checkpoints.
+    num_iterations: Total number of gradient steps.
+    batch_size: (observation, action) pairs per gradient step.
+    steps_per_run: Gradient steps fused into one session call.
+    learning_rate: Adam learning rate.
+    shuffle_buffer_size: Pairs held in the dataset shuffle buffer.
+    num_parallel_reads: Shards decompressed concurrently.
+    num_threads: TF intra/inter-op threads; 0 lets TF decide.
+    checkpoint_interval: Steps between checkpoints.
+    log_interval: Steps between loss logs and summaries.
+  """
+  root_dir = os.path.expanduser(root_dir)
+  train_dir = os.path.join(root_dir, 'train')
+
+  py_env = env_load_fn(env_name)
+  time_step_spec = tensor_spec.from_spec(py_env.time_step_spec())
+  action_spec = tensor_spec.from_spec(py_env.action_spec())
+  py_env.close()
+  data_spec = trajectory.Trajectory(
+      step_type=time_step_spec.step_type,
+      observation=time_step_spec.observation,
+      action=action_spec,
+      policy_info=(),
+      next_step_type=time_step_spec.step_type,
+      reward=time_step_spec.reward,
+      discount=time_step_spec.discount)
+
+  z_spec = tensor_spec.TensorSpec(
+      shape=[latent_action_generator.DIM_Z], dtype=latent_dtype, name='z')
+  action_generator = latent_action_generator.ActionGenerator(
+      input_tensor_spec=(time_step_spec.observation, z_spec),
+      dtype=latent_dtype)
+  action_generator.create_variables()
+  z_inference_network = latent_inference_network.ZInferenceNetwork(
+      input_tensor_spec=(time_step_spec.observation, action_spec),
+      dtype=latent_dtype)
+  z_inference_network.create_variables()
+  variables = (z_inference_network.trainable_variables +
+               action_generator.trainable_variables)
+
+  # Single steps without LAST steps: the VAE only needs (observation, action).
+  dataset = latent_replay_dataset.load_dataset(
+      data_dir, data_spec, batch_size, num_steps=1,
+      shuffle_buffer_size=shuffle_buffer_size,
+      num_parallel_reads=num_parallel_reads)
+  dataset_iterator = tf.compat.v1.data.make_initializable_iterator(dataset)
+
+  global_step = tf.compat.v1.train.get_or_create_global_step()
+  optimizer = tf.compat.v1.train.AdamOptimizer(learning_rate=learning_rate)
+
+  def _train_step():
+    experience = dataset_iterator.get_next()
+    z_kld, action_loss = latent_agent.vae_losses(
+        z_inference_network, action_generator,
+        experience.observation[:, 0], experience.action[:, 0])
+    grads = tf.gradients(z_kld + action_loss, variables)
+    train_op = optimizer.apply_gradients(
+        zip(grads, variables), global_step=global_step)
+    with tf.control_dependencies([train_op]):
+      return tf.identity(z_kld), tf.identity(action_loss)
+
+  # Creates the optimizer slots outside of the loop below.
+  _train_step()
+
+  def _train_body(i, unused_z_kld, unused_action_loss):
+    z_kld, action_loss = _train_step()
+    return i + 1, z_kld, action_loss
+
+  previous_step = global_step.read_value()
+  with tf.control_dependencies([previous_step]):
+    zero = tf.identity(tf.constant(0.0, dtype=latent_dtype))
+    _, z_kld, action_loss = tf.while_loop(
+        lambda i, unused_z_kld, unused_action_loss: i < steps_per_run,
+        _train_body,
+        [tf.identity(tf.constant(0)), zero, zero],
+        parallel_iterations=1,
+        back_prop=False)
+  with tf.control_dependencies([z_kld, action_loss]):
+    step = global_step.read_value()
+
+  # Written in the same run as the loop, from its last batch, once per
+  # log_interval crossed.
+  summary_writer = tf.compat.v2.summary.create_file_writer(train_dir)
+  should_log = step // log_interval > previous_step // log_interval
+  with summary_writer.as_default(), tf.compat.v2.summary.record_if(
+      should_log):
+    summary_ops = [
+        tf.compat.v2.summary.scalar(
+            name='loss_vae/z_kld', data=z_kld, step=step),
+        tf.compat.v2.summary.scalar(
+            name='loss_vae/action_loss', data=action_loss, step=step),
+    ]
+
+  # Same object paths as the `agent` entry of train_eval's train checkpoints.
+  actor_network = tf.Module(name='ActorNetworkMirror')
+  actor_network._action_generator_checkpointable = (
+      action_generator.checkpointable)
+  agent = tf.Module(name='AgentMirror')
+  agent._actor_network = actor_network
+  agent._z_inference_network_checkpointable = (
+      z_inference_network.checkpointable)
+  checkpointer = common.Checkpointer(
+      ckpt_dir=train_dir,
+      agent=agent,
+      vae_optimizer=optimizer,
+      global_step=global_step)
+
+  config = tf.compat.v1.ConfigProto(
+      intra_op_parallelism_threads=num_threads,
+      inter_op_parallelism_threads=num_threads)
+  with tf.compat.v1.Session(config=config) as sess:
+    checkpointer.initialize_or_restore(sess)
+    common.initialize_uninitialized_variables(sess)
+    sess.run(dataset_iterator.initializer)
+    sess.run(summary_writer.init())
+    run_call = sess.make_callable([z_kld, action_loss, step, summary_ops])
+    global_step_val = sess.run(global_step)
+    timed_at_step = global_step_val
+    start_time = time.time()
+
+    while global_step_val < num_iterations:
+      previous_step_val = global_step_val
+      z_kld_val, action_loss_val, global_step_val, _ = run_call()
+      if global_step_val // log_interval > previous_step_val // log_interval:
+        steps_per_sec = (global_step_val - timed_at_step) / (
+            time.time() - start_time)
+        logging.info('step = %d, z_kld = %f, action_loss = %f, %.1f steps/sec',
+                     global_step_val, z_kld_val, action_loss_val,
+                     steps_per_sec)
+        timed_at_step = global_step_val
+        start_time = time.time()
+      if (global_step_val // checkpoint_interval >
+          previous_step_val // checkpoint_interval):
+        checkpointer.save(global_step=global_step_val)
+    checkpointer.save(global_step=global_step_val)
+    sess.run(summary_writer.flush())
+
+
+def main(_):
+  tf.compat.v1.enable_resource_variables()
+  logging.set_verbosity(logging.INFO)
+  gin.parse_config_files_and_bindings(FLAGS.gin_file, FLAGS.gin_param)
+  train_vae(FLAGS.root_dir, FLAGS.data_dir)
+
+
+if __name__ == '__main__':
+  flags.mark_flag_as_required('root_dir')
+  flags.mark_flag_as_required('data_dir')
+  app.run(main)